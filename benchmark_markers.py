@@ -0,0 +1,59 @@
+import time
+import argparse
+import numpy as np
+import cv2
+
+from find_markers import find_markers, MarkerException
+
+
+def run(images, downscale, repeat):
+    found = []
+    durations = []
+    for img in images:
+        result = None
+        start_time = time.perf_counter()
+        for r in range(repeat):
+            try:
+                result = find_markers(img, downscale=downscale)
+            except MarkerException:
+                result = None
+        durations.append((time.perf_counter() - start_time) / repeat)
+        found.append(result)
+    return found, durations
+
+
+def corner_deviation(a, b):
+    # largest distance between corresponding marker corners of two detections of the same page
+    return max(np.max(np.linalg.norm(a[0] - b[0], axis=1)), np.max(np.linalg.norm(a[1] - b[1], axis=1)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the marker search on the full page with the coarse to fine '
+                                                 'search, e.g. on the images written by make_rotated_images.py')
+    parser.add_argument('files', nargs='+', help='The page images.')
+    parser.add_argument('--downscale', '-d', type=float, default=0.5,
+                        help='Scale factor of the coarse search.')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='Number of repetitions per image.')
+    args = parser.parse_args()
+
+    # pages are read as grayscale, like in the collection
+    images = [cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in args.files]
+
+    modes = [('full page', None), ('coarse to fine {:.2f}'.format(args.downscale), args.downscale)]
+    results = []
+    for name, downscale in modes:
+        found, durations = run(images, downscale, args.repeat)
+        results.append(found)
+        detected = sum(1 for f in found if f is not None)
+        print('{:>24}: {:6.2f} pages/sec, detected {}/{} ({:.0f}%)'
+              ''.format(name, len(images) / sum(durations), detected, len(images), 100. * detected / len(images)))
+
+    for file_name, full, coarse in zip(args.files, results[0], results[1]):
+        if full is None and coarse is None:
+            continue
+        if full is None or coarse is None:
+            print('{}: only detected by {}'.format(file_name, 'full page' if coarse is None else 'coarse to fine'))
+        elif full[2] != coarse[2]:
+            print('{}: different ids {} and {}'.format(file_name, full[2], coarse[2]))
+        else:
+            print('{}: max corner deviation {:.2f} pixels'.format(file_name, corner_deviation(full, coarse)))
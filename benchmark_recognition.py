@@ -0,0 +1,142 @@
+import os
+import time
+import argparse
+import numpy as np
+import cv2
+
+from pageid import PageId, compute_checksum
+from recognition import PageRecognizer, imap_pages, init_worker
+from parallel_utils import make_pool
+from profiling import Profiler
+from ocr import OCR_BACKENDS
+
+# A4 at the 200 dpi of the page recognition
+PAGE_SHAPE = (2339, 1654)
+
+
+def load_marker(folder, marker_id, unit):
+    # the marker images written by generate_marker_images.py, drawn with OpenCV if they do not exist
+    path = os.path.join(folder, 'aruco_4x4_50_{:02d}.png'.format(marker_id))
+    if os.path.isfile(path):
+        marker = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        return cv2.resize(marker, (unit, unit), interpolation=cv2.INTER_NEAREST)
+    return cv2.aruco.drawMarker(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50), marker_id, unit)
+
+
+def field_text(number):
+    # three digits and the checksum, like the printed fields
+    return '{:03d}{}'.format(number, compute_checksum(number))
+
+
+def put_centered_text(img, text, center, height):
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    (w, h), baseline = cv2.getTextSize(text, font, 1., 2)
+    scale = height / h
+    thickness = max(1, int(round(2 * scale)))
+    (w, h), baseline = cv2.getTextSize(text, font, scale, thickness)
+    cv2.putText(img, text, (int(center[0] - w / 2), int(center[1] + h / 2)), font, scale, 0, thickness, cv2.LINE_AA)
+
+
+def make_page(page_id, left_marker, right_marker, rng, rotation=0., noise=0., blur=0, jpeg_quality=None):
+    # The strip at the top of the page: the marker with the exam id, the fields for sheet, task and page,
+    # and the marker with the id 0, nine marker lengths wide. Below it a few lines of text, like on an exam.
+    unit = left_marker.shape[0]
+    img = np.full(PAGE_SHAPE, 255, dtype=np.uint8)
+    x0 = int(rng.integers(100, 200))
+    y0 = int(rng.integers(80, 160))
+    img[y0:y0 + unit, x0:x0 + unit] = left_marker
+    img[y0:y0 + unit, x0 + 8 * unit:x0 + 9 * unit] = right_marker
+    numbers = [page_id.sheet, page_id.task, page_id.page]
+    for k, number in enumerate(numbers):
+        if number is not None and number >= 0:
+            put_centered_text(img, field_text(number), (x0 + (2.5 + 2 * k) * unit, y0 + unit / 2), 0.45 * unit)
+    for line in range(20):
+        text = ' '.join(str(w) for w in rng.integers(0, 10 ** 6, size=6))
+        put_centered_text(img, text, (PAGE_SHAPE[1] / 2, y0 + (3 + line) * unit), 0.3 * unit)
+
+    if rotation > 0:
+        angle = rng.uniform(-rotation, rotation)
+        M = cv2.getRotationMatrix2D((PAGE_SHAPE[1] / 2, PAGE_SHAPE[0] / 2), angle, 1.0)
+        img = cv2.warpAffine(img, M, (PAGE_SHAPE[1], PAGE_SHAPE[0]), flags=cv2.INTER_LINEAR, borderValue=255)
+    if blur > 0:
+        img = cv2.GaussianBlur(img, (2 * blur + 1, 2 * blur + 1), 0)
+    if noise > 0:
+        img = np.clip(img + rng.normal(0., noise, size=img.shape), 0, 255).astype(np.uint8)
+    if jpeg_quality is not None:
+        data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1]
+        img = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    return img
+
+
+def random_page_id(rng, exam):
+    pid = PageId()
+    pid.exam = exam
+    pid.sheet = int(rng.integers(0, 1000))
+    # some pages do not belong to a task, their task field is empty
+    pid.task = int(rng.integers(0, 20)) if rng.random() > 0.1 else -1
+    pid.page = int(rng.integers(0, 30))
+    return pid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure speed and accuracy of the page recognition on synthetic '
+                                                 'scans with known page ids.')
+    parser.add_argument('--pages', '-n', type=int, default=100, help='Number of pages.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random page ids and distortions.')
+    parser.add_argument('--exam', type=int, default=3, help='The exam id, i.e. the id of the left marker.')
+    parser.add_argument('--unit', type=int, default=64, help='Side length of the markers in pixels.')
+    parser.add_argument('--markers', default='markers', help='Folder with the marker images.')
+    parser.add_argument('--rotation', type=float, default=2., help='Maximum rotation of the pages in degrees.')
+    parser.add_argument('--noise', type=float, default=5., help='Standard deviation of the gaussian noise.')
+    parser.add_argument('--blur', type=int, default=0, help='Radius of the gaussian blur in pixels.')
+    parser.add_argument('--jpeg-quality', type=int, default=75, help='JPEG quality of the scans (0 = no JPEG).')
+    parser.add_argument('--save', default=None, help='Write the synthetic pages to this folder.')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of worker processes (0 = one per core).')
+    parser.add_argument('--ocr', choices=OCR_BACKENDS, default='auto', help='The OCR backend.')
+    parser.add_argument('--ocr-batch', type=int, default=0,
+                        help='Read the fields of this many pages with a single OCR call.')
+    parser.add_argument('--no-digit-classifier', action='store_true', help='Read all fields with tesseract.')
+    parser.add_argument('--digit-templates', default=None, help='Templates of the digit classifier.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    left_marker = load_marker(args.markers, args.exam, args.unit)
+    right_marker = load_marker(args.markers, 0, args.unit)
+    truth = [random_page_id(rng, args.exam) for i in range(args.pages)]
+    images = [make_page(pid, left_marker, right_marker, rng, args.rotation, args.noise, args.blur,
+                        args.jpeg_quality if args.jpeg_quality > 0 else None) for pid in truth]
+    if args.save is not None:
+        os.makedirs(args.save, exist_ok=True)
+        for i, img in enumerate(images):
+            cv2.imwrite(os.path.join(args.save, 'page_{:04d}.png'.format(i)), img)
+
+    recognizer = PageRecognizer(ocr_backend=args.ocr, ocr_batch_pages=args.ocr_batch,
+                                digit_classifier=not args.no_digit_classifier, digit_templates=args.digit_templates,
+                                profile=True)
+    start_time = time.perf_counter()
+    with make_pool(args.jobs, init_worker) as pool:
+        results = list(imap_pages(pool, recognizer, images))
+    elapsed = time.perf_counter() - start_time
+
+    profiler = Profiler()
+    correct = marker_errors = unreadable = wrong = 0
+    for result, pid in zip(results, truth):
+        profiler.add(result.timings)
+        if result.error is not None:
+            marker_errors += 1
+        elif not result.page_id.is_valid():
+            unreadable += 1
+        elif result.page_id.tuple() != pid.tuple():
+            wrong += 1
+        else:
+            correct += 1
+
+    n = len(truth)
+    print('{} pages in {:.2f} s: {:.2f} pages/sec with {} job(s)'.format(n, elapsed, n / elapsed, args.jobs))
+    print('rotation {}, noise {}, blur {}, jpeg quality {}'.format(args.rotation, args.noise, args.blur,
+                                                                   args.jpeg_quality))
+    for line in profiler.summary():
+        print(line)
+    for name, count in [('correct', correct), ('marker errors', marker_errors), ('unreadable', unreadable),
+                        ('wrong id', wrong)]:
+        print('{:>14}: {:6d} ({:.1f}%)'.format(name, count, 100. * count / n))
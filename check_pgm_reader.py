@@ -0,0 +1,51 @@
+import sys
+import numpy as np
+
+from rendering import read_pgm_images
+
+
+def pgm(image, separator=b' '):
+    # an 8 bit binary pgm image, like the ones pdftoppm -gray writes
+    height, width = image.shape
+    return separator.join([b'P5', str(width).encode('ascii'), str(height).encode('ascii'), b'255']) + b'\n' + \
+        image.tobytes()
+
+
+def check_images(images):
+    # the pixels may contain whitespace bytes, they must not be taken for separators
+    data = pgm(images[0]) + pgm(images[1], b'\n') + pgm(images[2], b' \n ')
+    read = read_pgm_images(data)
+    if len(read) != len(images):
+        return 'Read {} images instead of {}.'.format(len(read), len(images))
+    for k, (image, expected) in enumerate(zip(read, images)):
+        if image.shape != expected.shape or not np.array_equal(image, expected):
+            return 'Image {} differs, its shape is {} instead of {}.'.format(k + 1, image.shape, expected.shape)
+    return None
+
+
+def check_error(data, description):
+    try:
+        read_pgm_images(data)
+    except ValueError:
+        return None
+    return 'No error for {}.'.format(description)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, size=shape, dtype=np.uint8) for shape in [(3, 5), (7, 2), (1, 1)]]
+    images[0][0, :4] = [ord(' '), ord('\n'), ord('\t'), ord('\r')]
+    data = pgm(images[0]) + pgm(images[1])
+    checks = [('three images', check_images(images)),
+              ('empty stream', None if read_pgm_images(b'') == [] else 'Read images from an empty stream.'),
+              ('stream ending in a header', check_error(data + b'P5 4 ', 'a stream ending in a header')),
+              ('stream ending in the magic number', check_error(b'P5', 'a stream ending in the magic number')),
+              ('stream ending in the pixels', check_error(data[:-1], 'a stream ending in the pixels')),
+              ('ascii pgm', check_error(b'P2 1 1 255\n0', 'an ascii pgm image')),
+              ('16 bit pgm', check_error(b'P5 1 1 65535\n\x00\x00', 'a 16 bit pgm image')),
+              ('invalid width', check_error(b'P5 x 1 255\n\x00', 'an invalid width'))]
+    failed = False
+    for name, error in checks:
+        print('{}: {}'.format(name, 'OK' if error is None else error))
+        failed = failed or error is not None
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,92 @@
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import resource
+import PyPDF2
+
+import index_store
+from collection import Collection
+from pageid import PageIdTable
+
+
+def page_size(sheet, page):
+    # every page of the synthetic collection is identified by the size of its media box
+    return 100 + sheet, 100 + page
+
+
+def make_sources(path, num_files, pages_per_file, num_sheets):
+    # Consecutive pages of the scans belong to different sheets, so each sheet of the reordered collection
+    # collects its pages from many source files.
+    Collection.make_new_collection(path)
+    index = dict()
+    for f in range(num_files):
+        writer = PyPDF2.PdfFileWriter()
+        ids = []
+        for k in range(pages_per_file):
+            g = f * pages_per_file + k
+            sheet, page = g % num_sheets, g // num_sheets
+            writer.addBlankPage(*page_size(sheet, page))
+            ids.append((1, sheet, 0, page))
+        file_name = 'scan_{:05d}.pdf'.format(f)
+        with open(os.path.join(path, file_name), 'wb') as out_file:
+            writer.write(out_file)
+        index[file_name] = PageIdTable.from_tuples(ids)
+    index_store.write_index(index, Collection.index_file(path), index_store.DEFAULT_INDEX_FORMAT)
+
+
+def check_collection(path, num_pages):
+    # every page of the index is at its place in its file, and no page is lost
+    index = index_store.read_index(Collection.index_file(path))
+    checked = 0
+    for file_name, table in index.items():
+        with open(os.path.join(path, file_name), 'rb') as in_file:
+            reader = PyPDF2.PdfFileReader(in_file)
+            if reader.getNumPages() != len(table):
+                return 'The file {} has {} pages, the index lists {}.'.format(file_name, reader.getNumPages(),
+                                                                             len(table))
+            for page_num, (exam, sheet, task, page) in enumerate(table.tuples()):
+                box = reader.getPage(page_num).mediaBox
+                if (int(box.getWidth()), int(box.getHeight())) != page_size(sheet, page):
+                    return 'Page {} of {} is not sheet {}, page {}.'.format(page_num + 1, file_name, sheet, page)
+                checked += 1
+    if checked != num_pages:
+        return 'The new collection has {} pages instead of {}.'.format(checked, num_pages)
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reorder a synthetic collection with many source files '
+                                                 'under a low limit of open files.')
+    parser.add_argument('--files', type=int, default=1200, help='Number of source files.')
+    parser.add_argument('--pages-per-file', type=int, default=2, help='Number of pages per source file.')
+    parser.add_argument('--sheets', type=int, default=10, help='Number of sheets.')
+    parser.add_argument('--nofile', type=int, default=64, help='Limit of open files of the process (ulimit -n).')
+    parser.add_argument('--max-open-files', type=int, default=32, help='Maximum number of open source files.')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4], help='Numbers of processes to check.')
+    parser.add_argument('--folder', default=None, help='Work folder, a temporary folder by default.')
+    args = parser.parse_args()
+
+    folder = args.folder if args.folder is not None else tempfile.mkdtemp(prefix='medocr_reorder_')
+    source_path = os.path.join(folder, 'scans')
+    try:
+        make_sources(source_path, args.files, args.pages_per_file, args.sheets)
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (args.nofile, hard))
+
+        failed = False
+        for jobs in args.jobs:
+            dest = os.path.join(folder, 'by_sheet_{}'.format(jobs))
+            try:
+                Collection(source_path).reorder_by('sheet', dest, jobs=jobs, max_open_files=args.max_open_files)
+                error = check_collection(dest, args.files * args.pages_per_file)
+            except OSError as ex:
+                error = str(ex)
+            print('{} source files, ulimit -n {}, --max-open-files {}, {} job(s): {}'
+                  ''.format(args.files, args.nofile, args.max_open_files, jobs, 'OK' if error is None else error))
+            failed = failed or error is not None
+        sys.exit(1 if failed else 0)
+    finally:
+        if args.folder is None:
+            shutil.rmtree(folder)
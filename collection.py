@@ -1,26 +1,27 @@
 import os
 import logging
 import shutil
-from pdf2image import convert_from_path
-import pytesseract
 import numpy as np
 import cv2
 import PyPDF2
-import time
 
 import os_utils
-import json_utils
-from find_markers import find_markers, extract_ocr_fields, MarkerException
-from pageid import PageId, page_id_from_ocr
+import index_store
+import validation
+import profiling
+from find_markers import MarkerException
+from pageid import PageId, PageIdTable, page_id_from_ocr
+from parallel_utils import make_pool, make_side_pool, number_of_jobs, Prefetcher, SerialPool
+from recognition import PageRecognizer, recognize_pdf, init_worker
+from rendering import PageRenderer, count_pages
+from fingerprints import FingerprintCache
+from pdf_sources import write_output, close_sources
+from thumbnails import ThumbnailCache, render_page
+from page_store import PageImageStore
 
 logger = logging.getLogger('medocr.'+__name__)
 
 
-def PIL_to_cv2(img):
-    # convert PIL image first to numpy array and then to the cv format for BGR color channels
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-
-
 def missing_pages_string(missing):
     return '\n'.join(['Sheet {}, page {},'.format(i[0], i[1]) for i in missing])
 
@@ -58,7 +59,13 @@ def make_page_display_window():
     cv2.resizeWindow('pagedisplay', 600, 800)
 
 
-def display_page(img, title):
+def display_page(img, title, strip=None):
+    # the strip with the markers and the fields is shown above the page, as wide as the page
+    if strip is not None:
+        strip = cv2.resize(strip, (img.shape[1], int(round(strip.shape[0] * img.shape[1] / strip.shape[1]))),
+                           interpolation=cv2.INTER_LINEAR)
+        gap = np.full((8, img.shape[1]), 255, dtype=img.dtype)
+        img = np.vstack([strip.astype(img.dtype), gap, img])
     cv2.imshow('pagedisplay', img)
     cv2.setWindowTitle('pagedisplay', title)
     cv2.waitKey(1)
@@ -88,26 +95,74 @@ def make_chunks(some_list, chunk_size, bind_feature=lambda i, p: i):
 
 
 class Collection:
-    def __init__(self, path):
+    def __init__(self, path, index_format=None):
         if not Collection.is_collection(path):
             raise OSError('The path {} does not point to a valid collection: '
                           'Either the directory does not exist, or it does not contain an index file'.format(path))
         logger.info('Working on collection {} .'.format(path))
         self._path = path
         self._index_file = Collection.index_file(self._path)
-        index_s = json_utils.read_json(self._index_file)
-        self._index = Collection.index_to_page_id(index_s)
+        # old collections with a JSON index are read as well, the index is written in index_format
+        self._index_format = index_format if index_format is not None else index_store.DEFAULT_INDEX_FORMAT
+        self._index = index_store.read_index(self._index_file)
+        # the changes since the index file was written the last time
+        self._journal = index_store.IndexJournal(Collection.journal_file(self._path))
+        self._journal.replay(self._index)
+        self._fingerprints = FingerprintCache(Collection.fingerprint_file(self._path))
+        # previews of the pages, made when they were added with a page store, otherwise it stays empty
+        self._page_store = PageImageStore(Collection.page_store_folder(self._path))
+        # renders the pages for the manual relabeling ahead of time, during the validation
+        self._thumbnails = None
         self._examid = None
         for pid_list in self._index.values():
             if len(pid_list) > 0:
                 self._examid = pid_list[0].exam
                 break
 
-    def add_pdf(self, pdf, action='clear'):
+    def add_pdfs(self, pdfs, action='clear', jobs=1, renderer=None, recognizer=None, reuse_known_pages=True,
+                 page_store_size=None):
+        if page_store_size is not None:
+            self._page_store.max_bytes = page_store_size
+        if renderer is None:
+            renderer = PageRenderer()
+        if recognizer is None:
+            recognizer = PageRecognizer()
+        # decide what to do with every file first, so that the next file can already be recognized
+        # while the current one is checked
+        to_add = []
+        for pdf in pdfs:
+            file_name = os.path.split(pdf)[1]
+            if file_name in [os.path.split(p)[1] for p in to_add]:
+                logger.warning('Skipping file %s, another file with the same name is added before.', pdf)
+            elif self.resolve_add_action(pdf, action) == 'clear':
+                to_add.append(pdf)
+        # the files ahead are recognized by the worker processes, with a single job there is no one to do that
+        files_ahead = 1 if number_of_jobs(jobs) > 1 else 0
+
+        # the pages that are rendered again are recognized by their own processes, see recognize_pdf
+        retry_pool = make_side_pool(jobs, init_worker) if renderer.retries_pages() else SerialPool()
+        with make_pool(jobs, init_worker) as pool, retry_pool:
+            started = []
+            try:
+                for i, pdf in enumerate(to_add):
+                    while len(started) < min(i + 1 + files_ahead, len(to_add)):
+                        started.append(self.start_recognition(to_add[len(started)], renderer, recognizer, pool,
+                                                              retry_pool, reuse_known_pages,
+                                                              in_background=len(started) > i))
+                    num_pages, results = started[i]
+                    try:
+                        self.add_recognized_pdf(pdf, num_pages, results)
+                    finally:
+                        results.close()
+            finally:
+                for num_pages, results in started:
+                    results.close()
+        # every added file is in the journal, the index file is written once at the end
+        self.write()
+
+    def resolve_add_action(self, pdf, action):
         folder, file_name = os.path.split(pdf)
-        file_is_in_index = file_name in self._index
-        index_pdf = self.file_in_collection(file_name)
-        if file_is_in_index:
+        if file_name in self._index:
             logger.info('File %s already exists in the collection.', file_name)
             if action == 'ask':
                 action = input('Select one of the following:\n'
@@ -120,106 +175,104 @@ class Collection:
             action = 'skip'
         if action == 'skip':
             logger.info('Skipping file %s', pdf)
-            return
-
-        if file_is_in_index:
+        return action
+
+    def start_recognition(self, pdf, renderer, recognizer, pool, retry_pool, reuse_known_pages, in_background=False):
+        num_pages = count_pages(pdf)
+        # the known pages include the entries of a file that is going to be overwritten
+        known_pages = self._fingerprints.lookup() if reuse_known_pages else None
+        results = recognize_pdf(pdf, self.file_in_collection('work'), renderer, recognizer, pool, known_pages,
+                                retry_pool)
+        if in_background:
+            # buffer at most one window of results
+            results = Prefetcher(results, depth=renderer.window_size)
+        return num_pages, results
+
+    def add_recognized_pdf(self, pdf, num_pages, results):
+        folder, file_name = os.path.split(pdf)
+        index_pdf = self.file_in_collection(file_name)
+        if file_name in self._index:
             logger.info('Overwriting file %s in the collection.', pdf)
             os.remove(index_pdf)
         else:
             logger.info('Adding file %s to the collection.', pdf)
-        self._index[file_name] = []
+        self._index[file_name] = PageIdTable()
+        self._page_store.remove_file(file_name)
         shutil.copyfile(pdf, index_pdf)
 
-        images = self.convert_pdf_to_images(file_name)
-
         logger.info('Reading the pages.')
-        self._index[file_name] = [None] * len(images)
+        self._index[file_name] = PageIdTable(num_pages)
+        self._fingerprints.set_file(file_name, num_pages)
         success = True
         marker_errors = 0
         continue_despite_marker_errors = False
-        max_allowed_marker_errors = min(3, len(images))
+        max_allowed_marker_errors = min(3, num_pages)
         logger.debug('Max allowed marker errors = {}.'.format(max_allowed_marker_errors))
         try:
-            wb = Waitbar(len(images), 'Page')
-            for page_num, img in enumerate(images):
+            wb = Waitbar(num_pages, 'Page')
+            # the results arrive in page order, so the checks below see the pages in the same
+            # order as before, no matter which worker finished first
+            for page_num, result in enumerate(results):
                 wb.print(page_num)
-                logger.debug('Page {} of {}'.format(page_num + 1, len(images)))
-                cv_image = cv2.imread(img)
+                logger.debug('Page {} of {}'.format(page_num + 1, num_pages))
+                if result.preview is not None or result.strip is not None:
+                    self._page_store.put(file_name, page_num, result.preview, result.strip)
+                profiling.record(result.timings, file_name, page_num)
                 try:
-                    left_marker, right_marker, left_id = find_markers(cv_image)
-                    ocr_fields = extract_ocr_fields(cv_image, left_marker, right_marker)
-                    self.set_or_check_exam_id(left_id)
+                    if result.error is not None:
+                        raise result.error
+                    self.set_or_check_exam_id(result.exam_id)
                 except MarkerException as mex:
                     logger.warning(mex)
                     marker_errors += 1
                     self._index[file_name][page_num] = PageId()
                 else:
-                    tesseract_options = r'--oem 3 --psm 6 outputbase digits'
-                    ocr_strings = [pytesseract.image_to_string(f, config=tesseract_options) for f in ocr_fields]
-                    page_id = page_id_from_ocr(left_id, ocr_strings)
-                    logger.debug('Page id = %s', page_id)
-                    self._index[file_name][page_num] = page_id
+                    logger.debug('Page id = %s', result.page_id)
+                    self._index[file_name][page_num] = result.page_id
+                    self._fingerprints.set_page(file_name, page_num, result.fingerprint, result.page_id)
 
                 if not continue_despite_marker_errors \
                         and marker_errors >= max_allowed_marker_errors\
                         and page_num <= 10:
-                    logger.warning('Encountered at least {} pages with either unidentifiable markers or markers with'
-                                   'the wrong id. The current exam id is {}.'
-                                   ''.format(max_allowed_marker_errors, self._examid))
-
-                    ans = input('Are you sure that you are reading the right pdf?\n'
-                                'Enter "continue" to treat all further errors as image recognition errors\n'
-                                'Enter "stop" if you do not want to enter this pdf to the collection\n'
-                                'WARNING: Continuing with a wrong pdf will result in a corrupted index.\n'
-                                ''.format(self._examid))
-                    while ans not in ['continue', 'stop']:
-                        ans = input('Enter "stop" or "continue".\n')
-                    if ans == 'continue':
-                        logger.info('Continuing. Treating further marker errors as image recognition errors. ')
-                        continue_despite_marker_errors = True
-                    else:
-                        logger.info('Stopping.')
+                    continue_despite_marker_errors = self.ask_to_continue_despite_marker_errors(
+                        max_allowed_marker_errors)
+                    if not continue_despite_marker_errors:
                         success = False
-                        continue_despite_marker_errors = False
                         break
             wb.done()
         except Exception as ex:
             logger.critical('An unhandled exception occurred during processing of the pdf {}.'.format(file_name))
-            self._index.pop(file_name)
-            self.write()
+            self.remove_from_index(file_name)
             os.remove(index_pdf)
             raise ex
         else:
             if success:
                 logger.info('Successfully added the pdf to the collection.')
-                self.write()
+                with profiling.profile('index write'):
+                    self._journal.set_file(file_name, self._index[file_name])
+                self.compact_journal_if_large()
             else:
                 logger.warning('The pdf was not be indexed completely and is not added to the collection.')
-                self._index.pop(file_name)
-                self.write()
+                self.remove_from_index(file_name)
                 os.remove(index_pdf)
 
-    def convert_pdf_to_images(self, file_name):
-        work_folder = self.file_in_collection('work')
-        os_utils.mkdir_if_nonexistent(work_folder)
-        os_utils.clear_files_with_extension(work_folder, 'jpg')
-        dpi = 200
-        logger.info('Converting the file "%s" to images.', file_name)
-        file_in_collection = self.file_in_collection(file_name)
-
-        # estimate the time for conversion
-        start_time = time.time()
-        convert_from_path(file_in_collection, first_page=1, last_page=1, dpi=dpi,
-                          fmt='jpg', grayscale=True, output_folder=work_folder)
-        time_elapsed = time.time() - start_time
-        pdf_reader = PyPDF2.PdfFileReader(file_in_collection)
-        num_pages = pdf_reader.getNumPages()
-        logger.info('Estimated time for conversion is {:.0f} seconds.'.format(num_pages * time_elapsed))
-
-        images = convert_from_path(file_in_collection, dpi=dpi, fmt='jpg',
-                                   grayscale=True, output_folder=work_folder, paths_only=True)
-        logger.debug('Completed conversion.')
-        return images
+    def ask_to_continue_despite_marker_errors(self, max_allowed_marker_errors):
+        logger.warning('Encountered at least {} pages with either unidentifiable markers or markers with'
+                       'the wrong id. The current exam id is {}.'
+                       ''.format(max_allowed_marker_errors, self._examid))
+
+        ans = input('Are you sure that you are reading the right pdf?\n'
+                    'Enter "continue" to treat all further errors as image recognition errors\n'
+                    'Enter "stop" if you do not want to enter this pdf to the collection\n'
+                    'WARNING: Continuing with a wrong pdf will result in a corrupted index.\n'
+                    ''.format(self._examid))
+        while ans not in ['continue', 'stop']:
+            ans = input('Enter "stop" or "continue".\n')
+        if ans == 'continue':
+            logger.info('Continuing. Treating further marker errors as image recognition errors. ')
+            return True
+        logger.info('Stopping.')
+        return False
 
     def set_or_check_exam_id(self, exam_id_input):
         if self._examid is None:
@@ -233,39 +286,78 @@ class Collection:
         if os_utils.is_composite(file):
             raise RuntimeError('The name of the file to remove cannot be a path.')
         if file in self._index:
-            self._index.pop(file)
+            self.remove_from_index(file)
             file_in_index = os.path.join(self._path, file)
             if os.path.isfile(file_in_index):
                 os.remove(file_in_index)
             else:
                 logger.warning('The file to be removed was listed in the index but not present in the file system.')
+            # the removal is moved from the journal to the index and the fingerprints of the file are dropped
             self.write()
         else:
             logger.warning('The collection does not contain the file {}.'.format(file))
 
-    def reorder_by(self, by, dest, chunk_size=0):
+    def reorder_by(self, by, dest, chunk_size=0, jobs=1, max_open_files=None):
         logger.info('Creating the new collection %s, ordered by %s.', dest, by)
+        output_files = self.plan_reorder(by, chunk_size)
+        by_category = Collection.make_new_collection(dest, self._index_format)
+
+        # The output files are written by the worker processes. Every process parses each source pdf it needs once
+        # and shares its pages between all the output files it writes. The limit of open source files is divided
+        # between the processes, and a source is closed as soon as no later output file needs it.
+        max_open = None
+        if max_open_files is not None:
+            if max_open_files < 2:
+                raise ValueError('At least 2 source files must be allowed to be open at once, '
+                                 'got {}'.format(max_open_files))
+            # every process needs at least 2 open sources
+            if number_of_jobs(jobs) > max_open_files // 2:
+                logger.warning('Using %d instead of %d processes, so that at most %d source files are open.',
+                               max_open_files // 2, number_of_jobs(jobs), max_open_files)
+                jobs = max_open_files // 2
+            max_open = max_open_files // number_of_jobs(jobs)
+        last_uses = [[] for f in output_files]
+        last_use_of_source = dict()
+        for i, (file_dest, page_list) in enumerate(output_files):
+            for p in page_list:
+                last_use_of_source[p[0]] = i
+        for file_name, i in last_use_of_source.items():
+            last_uses[i].append(file_name)
+        tasks = [(self._path, max_open, [(p[0], p[1]) for p in page_list], os.path.join(dest, file_dest), last_uses[i])
+                 for i, (file_dest, page_list) in enumerate(output_files)]
+        try:
+            with make_pool(jobs) as pool:
+                wb = Waitbar(len(tasks), 'File')
+                for i, out_path in enumerate(pool.imap(write_output, tasks)):
+                    wb.print(i)
+                    logger.debug('Created file %s', out_path)
+                wb.done()
+        finally:
+            # the sources opened in this process, when there are no worker processes
+            close_sources()
+
+        # the index is assembled in the order of the plan, independent of the order in which the files were written
+        for file_dest, page_list in output_files:
+            by_category._index[file_dest] = PageIdTable.from_page_ids([p[2] for p in page_list])
+        by_category.write()
+        return Collection(dest, self._index_format)
+
+    def plan_reorder(self, by, chunk_size=0):
+        # returns the names of the output files together with their pages as (file name, page number, page id)
         if by not in ['sheet', 'task']:
             raise ValueError('The order criterion must be one of "sheet", "task".')
-        #  gather all pages for each sheet/task number
-        pages_by_category = dict()
-        for file_name, id_list in self._index.items():
-            for file_page, page_id in enumerate(id_list):
-                if by == 'sheet':
-                    page_group = page_id.sheet
-                else:  # by == 'task':
-                    page_group = page_id.task
-                if page_group not in pages_by_category:
-                    pages_by_category[page_group] = []
-                pages_by_category[page_group].append((file_name, file_page, page_id))
-
-        by_category = Collection.make_new_collection(dest)
-
-        for page_group, page_list in pages_by_category.items():
+        file_names, file_nums, file_pages, table = self.index_table()
+        page_ids = list(table)
+        file_nums = file_nums.tolist()
+        file_pages = file_pages.tolist()
+        output_files = []
+        for page_group, rows in table.group_by(by).items():
+            # the rows of the group are in index order, the sort is stable
             if by == 'sheet':
-                sorted_page_list = sorted(page_list, key=lambda paddr: paddr[2].page)
+                rows = rows[table.filter(rows).argsort(['page'])]
             else:  # by == 'task':
-                sorted_page_list = sorted(page_list, key=lambda paddr: (paddr[2].sheet, paddr[2].page))
+                rows = rows[table.filter(rows).argsort(['sheet', 'page'])]
+            sorted_page_list = [(file_names[file_nums[r]], file_pages[r], page_ids[r]) for r in rows.tolist()]
 
             # split list into chunks, do not split in between sheets
             # if order-by sheet, there should not be chunks
@@ -276,30 +368,8 @@ class Collection:
                     file_dest = '{}{}_chunk{}.pdf'.format(by, page_group, ci)
                 else:
                     file_dest = '{}{}.pdf'.format(by, page_group)
-
-                by_category._index[file_dest] = []
-                logger.info('Creating file %s', file_dest)
-
-                open_infiles = dict()
-                merger = PyPDF2.PdfFileMerger()
-
-                wb = Waitbar(len(chunk), 'Page')
-                for i, page_addr in enumerate(chunk):
-                    wb.print(i)
-                    file_name = page_addr[0]
-                    file_page = page_addr[1]
-                    page_id = page_addr[2]
-                    in_file_name = os.path.join(self._path, file_name)
-                    if in_file_name not in open_infiles:
-                        open_infiles[in_file_name] = open(in_file_name, 'rb')
-                    merger.append(open_infiles[in_file_name], pages=(file_page, file_page + 1))
-                    by_category._index[file_dest].append(page_id)
-                wb.done()
-                with open(os.path.join(dest, file_dest), 'wb') as out_file:
-                    merger.write(out_file)
-                merger.close()
-                by_category.write()
-        return Collection(dest)
+                output_files.append((file_dest, chunk))
+        return output_files
 
     def validate(self, extra_pages):
         logger.info('Validating.')
@@ -308,14 +378,19 @@ class Collection:
         rem_i = []
         rem_i_fs = []
         change_log = {}
+        self._thumbnails = ThumbnailCache(self._path, page_store=self._page_store)
         try:
             rem_i, rem_i_fs = self.remove_corrupt_entries()
             invalids = self.find_invalid_entries()
+            self._thumbnails.set_order(invalids)
             self.label_invalid_entries_manually(invalids, change_log)
+            # after the first round, only the relabeled pages are checked for duplicates again
+            duplicate_finder = validation.DuplicateFinder(*self.index_table())
             duplicates = {('', 0): []}  # dummy duplicate dict to start the loop
             while len(duplicates.keys()) > 0:
-                duplicates = self.find_duplicates()
-                self.resolve_duplicates(duplicates, change_log)
+                duplicates = self.find_duplicates(duplicate_finder)
+                self._thumbnails.set_order([page_addr for duplist in duplicates.values() for page_addr in duplist])
+                self.resolve_duplicates(duplicates, change_log, duplicate_finder)
             missing = self.find_missing_pages(extra_pages)
         except KeyboardInterrupt as ki:
             logger.warning('Keyboard interrupt during validation. Writing collection.')
@@ -324,6 +399,8 @@ class Collection:
             logger.warning(di)
             raise di
         finally:
+            self._thumbnails.close()
+            self._thumbnails = None
             destroy_page_display_window()
             # The order of these outputs is reverse to the order of the validation step
             # The most serious warnings should appear at the bottom.
@@ -363,11 +440,11 @@ class Collection:
         logger.info('Removing the index entries for the missing files.')
         for item in remove_from_index:
             logger.info('{}'.format(item))
-            self._index.pop(item)
+            self.remove_from_index(item)
         logger.info('Removing the index entry and file for the corrupted entries.')
         for item in remove_from_index_and_file_system:
             logger.info('{}'.format(item))
-            self._index.pop(item)
+            self.remove_from_index(item)
             file_in_index = os.path.join(self._path, item)
             os.remove(file_in_index)
         return remove_from_index, remove_from_index_and_file_system
@@ -375,10 +452,9 @@ class Collection:
     def find_invalid_entries(self):
         invalids = []
         logger.info('Finding invalid entries.')
-        for file_name, id_list in self._index.items():
-            for page_num, page_id in enumerate(id_list):
-                if page_id is None or not page_id.is_valid():
-                    invalids.append((file_name, page_num))
+        file_names, file_nums, file_pages, table = self.index_table()
+        for row in np.flatnonzero(~table.valid()).tolist():
+            invalids.append((file_names[file_nums[row]], int(file_pages[row])))
         return invalids
 
     def label_invalid_entries_manually(self, invalids, change_log):
@@ -390,31 +466,13 @@ class Collection:
             new_label = self.ask_for_label(file_name, page_num)
             self.update_index_and_change_log(change_log, file_name, page_num, new_label)
 
-    def find_duplicates(self):
+    def find_duplicates(self, duplicate_finder=None):
         logger.info('Finding duplicate entries.')
-        duplicates = dict()
-        pages_by_id = dict()
-
-        for file_name, id_list in self._index.items():
-            for page_num, page_id in enumerate(id_list):
-                idt = page_id.tuple()
-                # found a duplicate
-                if idt in pages_by_id:
-                    # this is a new duplicate
-                    # create a new duplicate entry with the address of the current item and
-                    # the address of the referenced item
-                    if idt not in duplicates:
-                        duplicates[idt] = [(file_name, page_num), pages_by_id[idt]]
-                    # there are already more than two entries with the same page_id
-                    # simply append the current item to the list of duplicates
-                    else:
-                        duplicates[idt].append((file_name, page_num))
-                # no duplicate
-                else:
-                    pages_by_id[idt] = (file_name, page_num)
-        return duplicates
+        if duplicate_finder is None:
+            duplicate_finder = validation.DuplicateFinder(*self.index_table())
+        return duplicate_finder.duplicates()
 
-    def resolve_duplicates(self, duplicates, change_log):
+    def resolve_duplicates(self, duplicates, change_log, duplicate_finder=None):
         logger.info('Resolving duplicate entries.')
         # for idt, duplist in duplicates.items():
         for i, idt in enumerate(duplicates.keys()):
@@ -424,6 +482,8 @@ class Collection:
             for page_addr in duplist:
                 pid = self.ask_for_label(page_addr[0], page_addr[1])
                 self.update_index_and_change_log(change_log, page_addr[0], page_addr[1], pid)
+                if duplicate_finder is not None:
+                    duplicate_finder.relabel(page_addr[0], page_addr[1], pid)
                 # self._index[page_addr[0]][page_addr[1]] = pid
                 if pid.tuple() == idt:
                     unchanged.append(page_addr)
@@ -435,12 +495,16 @@ class Collection:
                                      ''.format(unchanged[0][0], unchanged[0][1]+1, unchanged[1][0], unchanged[1][1]+1))
 
     def ask_for_label(self, file_name, page_num):
-        PIL_img = convert_from_path(os.path.join(self._path, file_name), first_page=page_num+1, last_page=page_num+1, dpi=100, fmt='jpg', grayscale=True)
-        img = PIL_to_cv2(PIL_img[0])
+        if self._thumbnails is not None:
+            img = self._thumbnails.get(file_name, page_num)
+        else:
+            img = render_page(os.path.join(self._path, file_name), page_num, dpi=100)
+        # the upright strip of the fields, as it was read during the recognition, None without a page store
+        strip = self._page_store.strip(file_name, page_num)
         window_title = 'File {}, page {}'.format(file_name, page_num+1)
         print(window_title)
         # logger.debug('Relabel %s ', window_title)
-        display_page(img, window_title)
+        display_page(img, window_title, strip)
 
         pid = PageId()
         while not pid.is_valid():
@@ -458,37 +522,44 @@ class Collection:
             old_label = self._index[file_name][page_num]
 
         self._index[file_name][page_num] = new_label
+        self._journal.set_page(file_name, page_num, new_label)
+        self.compact_journal_if_large()
+        self._fingerprints.relabel(file_name, page_num, new_label)
         change_log[file_name][page_num] = (old_label, new_label)
         logger.debug('Changed label for file {}, page {} to {}'.format(file_name, page_num, new_label))
 
     def find_missing_pages(self, extra_pages=()):
         logger.info('Find missing pages.')
-        # find all unique sheet ids and page numbers
-        sheets = set()
-        pages = set()
-        for id_list in self._index.values():
-            for pid in id_list:
-                sheets.add(pid.sheet)
-                if pid.page not in extra_pages:
-                    pages.add(pid.page)
-
-        # map from sheet ids and page numbers to rows and cols of an array
-        sheet_rows = {s: i for i, s in enumerate(sheets)}
-        page_cols = {p: i for i, p in enumerate(pages)}
-        sheets_x_pages = np.zeros((len(sheet_rows), len(page_cols)))
-        # find all combinations of sheet id and page numbers that exist in the index
-        for id_list in self._index.values():
-            for pid in id_list:
-                if pid.page not in extra_pages:
-                    sheets_x_pages[sheet_rows[pid.sheet], page_cols[pid.page]] = 1
-        # all other combinations are missing
-        missing = [(s, p) for s in sheets for p in pages if sheets_x_pages[sheet_rows[s], page_cols[p]] == 0]
+        file_names, file_nums, file_pages, table = self.index_table()
         # this algorithm will not report a page missing if it misses in each sheet
-        return missing
+        return validation.find_missing_pages(table, extra_pages)
+
+    def remove_from_index(self, file_name):
+        self._index.pop(file_name)
+        self._journal.remove_file(file_name)
+        self._page_store.remove_file(file_name)
+        self.compact_journal_if_large()
+
+    def compact_journal_if_large(self):
+        if self._journal.changed_pages >= index_store.JOURNAL_COMPACTION_PAGES:
+            logger.debug('Moving %d changed pages from the journal to the index file.', self._journal.changed_pages)
+            self.write()
 
     def write(self):
-        index_s = Collection.index_to_serializable(self._index)
-        json_utils.write_json(index_s, self._index_file)
+        # checkpoint: the whole index is written and replaces the old index file in one step,
+        # only then the journal is cleared
+        with profiling.profile('index write'):
+            index_store.write_index(self._index, self._index_file, self._index_format)
+            self._journal.clear()
+            self._fingerprints.write(self._index.keys())
+
+    def index_table(self):
+        # all page ids of the collection in one table, together with the file and the page number in the file
+        file_names = list(self._index.keys())
+        tables = [self._index[f] for f in file_names]
+        file_nums = np.repeat(np.arange(len(tables)), [len(t) for t in tables])
+        file_pages = np.concatenate([np.arange(len(t)) for t in tables] + [np.zeros(0, dtype=int)])
+        return file_names, file_nums, file_pages, PageIdTable.concatenate(tables)
 
     def __contains__(self, item):
         return item in self._index
@@ -498,20 +569,6 @@ class Collection:
             raise RuntimeError('The name of the file in the collection cannot be a path: %s.', file_name)
         return os.path.join(self._path, file_name)
 
-    @staticmethod
-    def index_to_serializable(index):
-        index_s = dict()
-        for file_name, id_list in index.items():
-            index_s[file_name] = [pid.tuple() for pid in id_list]
-        return index_s
-
-    @staticmethod
-    def index_to_page_id(index):
-        index_p = dict()
-        for file_name, id_list in index.items():
-            index_p[file_name] = [PageId(s) for s in id_list]
-        return index_p
-
     @staticmethod
     def is_collection(path):
         if not os.path.isdir(path):
@@ -529,18 +586,32 @@ class Collection:
         return os.path.join(path, 'index')
 
     @staticmethod
-    def make_new_collection(path):
+    def page_store_folder(path):
+        return os.path.join(path, 'pages')
+
+    @staticmethod
+    def journal_file(path):
+        return os.path.join(path, 'index.journal')
+
+    @staticmethod
+    def fingerprint_file(path):
+        return os.path.join(path, 'fingerprints')
+
+    @staticmethod
+    def make_new_collection(path, index_format=None):
         if os.path.isdir(path):
             raise OSError('The directory already exists {}'.format(path))
 
         logger.info('Creating the new collection %s', path)
         os.mkdir(path)
-        json_utils.write_json(dict(), Collection.index_file(path))
-        return Collection(path)
+        if index_format is None:
+            index_format = index_store.DEFAULT_INDEX_FORMAT
+        index_store.write_index(dict(), Collection.index_file(path), index_format)
+        return Collection(path, index_format)
 
     @staticmethod
-    def make_or_read_collection(path):
+    def make_or_read_collection(path, index_format=None):
         if Collection.is_collection(path):
             logger.info('Reading existing collection %s', path)
-            return Collection(path)
-        return Collection.make_new_collection(path)
+            return Collection(path, index_format)
+        return Collection.make_new_collection(path, index_format)
@@ -0,0 +1,31 @@
+import sys
+import argparse
+
+from recognition import PageRecognizer, imap_pages
+from parallel_utils import SerialPool
+from ocr import OCR_BACKENDS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that batched OCR gives the same checksum validated page ids '
+                                                 'as reading each field on its own.')
+    parser.add_argument('files', nargs='+', help='The page images of the regression corpus.')
+    parser.add_argument('--ocr', choices=OCR_BACKENDS, default='auto', help='The OCR backend.')
+    parser.add_argument('--ocr-batch', type=int, default=10, help='Number of pages per batched OCR call.')
+    args = parser.parse_args()
+
+    # the digit classifier would read most fields in both runs, only tesseract is compared
+    per_field = PageRecognizer(ocr_backend=args.ocr, digit_classifier=False).recognize_batch(args.files)
+    # each OCR call reads the fields of --ocr-batch pages, like add --ocr-batch does
+    batched_recognizer = PageRecognizer(ocr_backend=args.ocr, ocr_batch_pages=args.ocr_batch, digit_classifier=False)
+    batched = list(imap_pages(SerialPool(), batched_recognizer, args.files))
+
+    mismatches = 0
+    for file_name, single, batch in zip(args.files, per_field, batched):
+        if single.error is not None:
+            continue
+        if single.page_id.tuple() != batch.page_id.tuple():
+            mismatches += 1
+            print('{}: per field {}, batched {}'.format(file_name, single.page_id.tuple(), batch.page_id.tuple()))
+    located = sum(1 for r in per_field if r.error is None)
+    print('{} of {} pages with markers differ.'.format(mismatches, located))
+    sys.exit(1 if mismatches > 0 else 0)
@@ -1,12 +1,12 @@
 import os
-import copy
-import PyPDF2
 import argparse
 import logging
 import sys
 
 import os_utils
 from defaultlogger import set_default_logging_behavior
+from parallel_utils import make_pool, number_of_jobs
+from marked_exams import write_files, split_files, split_tasks, get_exam, close_exams
 logger = logging.getLogger('medocr.create_marked_exams')
 
 
@@ -18,6 +18,14 @@ if __name__ == '__main__':
     parser.add_argument('exam', type=str, help='.pdf file of the exam')
     parser.add_argument('marks', type=str, help='.pdf file that contains the marks to be joined with the exam')
     parser.add_argument('--output', '-o', type=str, default=None, help='The folder for outputs')    
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of processes that write the files (0 = one per core)')
+    parser.add_argument('--merge-pages', action='store_true',
+                        help='Merge the content of the exam into every page, instead of storing each exam page '
+                             'once per file and drawing it on the marked pages')
+    parser.add_argument('--bundle-size', type=int, default=1,
+                        help='Number of marked exams in each output file')
+    parser.add_argument('--single-file', action='store_true', help='Write all marked exams into a single file')
     args = parser.parse_args()
     
     try: 
@@ -32,24 +40,24 @@ if __name__ == '__main__':
         os_utils.mkdir_if_nonexistent(args.output)   
         os_utils.clear_files_with_extension(args.output, 'pdf')
 
-        with open(args.exam, 'rb') as exam_file: 
-            with open(args.marks, 'rb') as marks_file:
-                exam_pdf_reader = PyPDF2.PdfFileReader(exam_file)
-                marks_pdf_reader = PyPDF2.PdfFileReader(marks_file)
-                
-                for idx in range(marks_pdf_reader.numPages):
-                    print('\r                                            \r'
-                          'File {}/{}'.format(idx, marks_pdf_reader.numPages), end='')
-                    out_writer = PyPDF2.PdfFileWriter()
-                    mark_page = marks_pdf_reader.getPage(idx)
-                    for exam_page_number in range(exam_pdf_reader.numPages):
-                        exam_page_original = exam_pdf_reader.getPage(exam_page_number)
-                        exam_page = copy.copy(exam_page_original)
-                        exam_page.mergePage(mark_page)
-                        out_writer.addPage(exam_page)
-                    out_file_name = '{0}_{1:03d}.pdf'.format(exam_name, idx)
-                    with open(os.path.join(args.output, out_file_name), 'wb') as out_file:
-                        out_writer.write(out_file)
+        num_marks = get_exam(args.exam, args.marks, args.merge_pages).num_marks
+        jobs = number_of_jobs(args.jobs)
+        if jobs > 1:
+            # the workers open the files themselves
+            close_exams()
+        if args.bundle_size < 1:
+            raise ValueError('The bundle size must be at least 1, got {}'.format(args.bundle_size))
+        bundle_size = max(1, num_marks) if args.single_file else args.bundle_size
+        tasks = [(args.exam, args.marks, args.merge_pages, args.output, exam_name, files)
+                 for files in split_tasks(split_files(num_marks, bundle_size), jobs)]
+        done = 0
+        with make_pool(jobs) as pool:
+            for num_written in pool.imap(write_files, tasks):
+                done += num_written
+                print('\r                                            \r'
+                      'File {}/{}'.format(done, num_marks), end='')
+        print('')
+        close_exams()
 
     except Exception as ex:
         logger.critical('', exc_info=ex)
@@ -0,0 +1,103 @@
+import os
+import logging
+import numpy as np
+import cv2
+
+logger = logging.getLogger('medocr.'+__name__)
+
+CELL_SIZE = 16
+DIGITS_PER_FIELD = 4
+
+
+def to_grayscale(field):
+    if field.ndim == 3:
+        return cv2.cvtColor(field, cv2.COLOR_BGR2GRAY)
+    return field
+
+
+def is_blank(field, ink_threshold=128, max_ink_fraction=0.002):
+    return np.count_nonzero(to_grayscale(field) < ink_threshold) <= max_ink_fraction * field.shape[0] * field.shape[1]
+
+
+def segment_digits(field, min_height_fraction=0.3):
+    # Splits a field into the cells of its printed digits, ordered from left to right.
+    # Each cell is the bounding box of a connected component, scaled to CELL_SIZE x CELL_SIZE.
+    gray = to_grayscale(field)
+    _, bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(bw)
+    boxes = [stats[i, :4] for i in range(1, num_labels)
+             if stats[i, cv2.CC_STAT_HEIGHT] >= min_height_fraction * field.shape[0]]
+    cells = []
+    for x, y, w, h in sorted(boxes, key=lambda b: b[0]):
+        # keep the aspect ratio, a 1 must not look like an 8
+        side = max(w, h)
+        cell = np.zeros((side, side), dtype=np.uint8)
+        cell[(side - h) // 2:(side - h) // 2 + h, (side - w) // 2:(side - w) // 2 + w] = bw[y:y + h, x:x + w]
+        cell = cv2.resize(cell, (CELL_SIZE, CELL_SIZE), interpolation=cv2.INTER_AREA)
+        cells.append(cell.astype(np.float32).ravel() / 255.)
+    return cells
+
+
+class DigitClassifier:
+    # Nearest neighbour classifier for the printed digits of the fields.
+    # The templates are learned from fields that tesseract read with a valid checksum.
+    def __init__(self, max_distance=0.3, max_templates_per_digit=20):
+        self.max_distance = max_distance
+        self.max_templates_per_digit = max_templates_per_digit
+        self._templates = np.zeros((0, CELL_SIZE * CELL_SIZE), dtype=np.float32)
+        self._labels = np.zeros((0,), dtype=np.int8)
+
+    def num_templates(self):
+        return len(self._labels)
+
+    def read_field(self, field):
+        # Returns the digits of the field as a string, '' for a blank field, and None if the field
+        # does not look like four known printed digits (e.g. handwriting); these are left to tesseract.
+        if is_blank(field):
+            return ''
+        if self.num_templates() == 0:
+            return None
+        cells = segment_digits(field)
+        if len(cells) != DIGITS_PER_FIELD:
+            return None
+        # root mean square distance of the cells to all templates
+        distances = np.sqrt(np.mean((np.array(cells)[:, np.newaxis, :] - self._templates[np.newaxis, :, :])**2,
+                                    axis=2))
+        nearest = np.argmin(distances, axis=1)
+        if np.max(distances[np.arange(len(cells)), nearest]) > self.max_distance:
+            return None
+        return ''.join(str(self._labels[n]) for n in nearest)
+
+    def learn(self, field, text):
+        # text must be the validated content of the field
+        cells = segment_digits(field)
+        if len(cells) != len(text):
+            return
+        for cell, digit in zip(cells, text):
+            digit = int(digit)
+            if np.count_nonzero(self._labels == digit) >= self.max_templates_per_digit:
+                continue
+            self._templates = np.vstack([self._templates, cell[np.newaxis, :]])
+            self._labels = np.append(self._labels, np.int8(digit))
+
+    def save(self, path):
+        np.savez(path, templates=self._templates, labels=self._labels)
+
+    def load(self, path):
+        data = np.load(path)
+        self._templates = data['templates'].astype(np.float32)
+        self._labels = data['labels'].astype(np.int8)
+        logger.debug('Loaded %d digit templates from %s.', self.num_templates(), path)
+
+
+# one classifier per template file and process, it keeps learning during the lifetime of the (worker) process
+_classifiers = dict()
+
+
+def get_digit_classifier(template_file=None):
+    if template_file not in _classifiers:
+        classifier = DigitClassifier()
+        if template_file is not None and os.path.isfile(template_file):
+            classifier.load(template_file)
+        _classifiers[template_file] = classifier
+    return _classifiers[template_file]
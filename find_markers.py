@@ -2,6 +2,8 @@ import numpy as np
 import cv2
 import argparse
 
+from profiling import timed
+
 
 class MarkerException(Exception):
     pass
@@ -28,44 +30,103 @@ def check_marker_is_square(marker_corners):
 
 
 def extract_ocr_fields(image, left_marker, right_marker):
-    pos = left_marker[0, :]
-
-    dx = right_marker[1, :] - left_marker[0, :]
-    dy = left_marker[3, :] - left_marker[0, :]
-    ref_length = 1./9. * np.linalg.norm(dx)
-
-    angle = np.arctan2(dx[1], dx[0]) * 180. / np.pi  # arctan2 takes y coordinate first
-    pos_h = np.matrix([[pos[0]], [pos[1]], [1.]])
-    M = cv2.getRotationMatrix2D((image.shape[0]//2, image.shape[1]//2), angle, 1.0)
-    pos_h_rot = np.matrix(M) * pos_h
-    pos_rot = pos_h_rot[:2]
-    rotated = cv2.warpAffine(image, M, (image.shape[1], image.shape[0]), flags=cv2.INTER_CUBIC,
-                             borderMode=cv2.BORDER_CONSTANT)
-    ocr_area = rotated[int(pos_rot[1]):int(pos_rot[1] + ref_length), int(pos_rot[0]):int(pos_rot[0] + 9. * ref_length), :]
+    ocr_area, ref_length = warp_strip(image, left_marker, right_marker)
+    return cut_ocr_fields(ocr_area, ref_length)
+
+
+def warp_strip(image, left_marker, right_marker):
+    # The text field is the quadrilateral between the outer corners of the two markers.
+    # Only this quadrilateral is warped to an upright rectangle, which is much cheaper than rotating the whole page
+    # and also corrects slight perspective distortions of the scan.
+    top_left = left_marker[0, :]
+    top_right = right_marker[1, :]
+    bottom_right = right_marker[2, :]
+    bottom_left = left_marker[3, :]
+    ref_length = 1./9. * np.linalg.norm(top_right - top_left)
+
+    width = int(round(9. * ref_length))
+    height = int(round(ref_length))
+    field_corners = np.array([top_left, top_right, bottom_right, bottom_left], dtype=np.float32)
+    rect_corners = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
+    M = cv2.getPerspectiveTransform(field_corners, rect_corners)
+    ocr_area = cv2.warpPerspective(image, M, (width, height), flags=cv2.INTER_CUBIC,
+                                   borderMode=cv2.BORDER_CONSTANT)
+    return ocr_area, ref_length
+
+
+def cut_ocr_fields(ocr_area, ref_length):
     eps = 5
 
     '''cv2.rectangle(ocr_area, (int(1.5 * ref_length+eps), 0+eps), (int(3.5 * ref_length-eps), int(ref_length-eps)), (255, 0, 0), 1)
     cv2.rectangle(ocr_area, (int(3.5 * ref_length+eps), 0+eps), (int(5.5 * ref_length-eps), int(ref_length-eps)), (0, 255, 0), 1)
     cv2.rectangle(ocr_area, (int(5.5 * ref_length+eps), 0+eps), (int(7.5 * ref_length-eps), int(ref_length-eps)), (0, 0, 255), 1)'''
-    '''cv2.rectangle(rotated, (int(pos_rot[0]), int(pos_rot[1])), (int(pos_rot[0] + 9. * ref_length), int(pos_rot[1] + ref_length)),
-                  (255, 0, 0), 3)'''
 
-    ocr_fields = [ocr_area[eps:-eps, int(1.5 * ref_length + eps):int(3.5 * ref_length - eps), :],
-                  ocr_area[eps:-eps, int(3.5 * ref_length + eps):int(5.5 * ref_length - eps), :],
-                  ocr_area[eps:-eps, int(5.5 * ref_length + eps):int(7.5 * ref_length - eps), :]
+    ocr_fields = [ocr_area[eps:-eps, int(1.5 * ref_length + eps):int(3.5 * ref_length - eps)],
+                  ocr_area[eps:-eps, int(3.5 * ref_length + eps):int(5.5 * ref_length - eps)],
+                  ocr_area[eps:-eps, int(5.5 * ref_length + eps):int(7.5 * ref_length - eps)]
                   ]
     return ocr_fields
 
 
-def find_markers(img):
+def marker_strip_box(left_marker, right_marker):
+    # the bounding box (x, y, width, height) of the markers and the fields between them,
+    # with a margin of one marker length
+    corners = np.concatenate([left_marker, right_marker])
+    margin = np.linalg.norm(left_marker[1, :] - left_marker[0, :])
+    x0, y0 = np.maximum(np.floor(np.min(corners, axis=0) - margin), 0).astype(int)
+    x1, y1 = np.ceil(np.max(corners, axis=0) + margin).astype(int)
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+
+def detect_markers(img):
     markers = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
     corners, ids, rejected = cv2.aruco.detectMarkers(img, markers)
+    return corners, ids
+
+
+def detect_markers_coarse_to_fine(img, downscale):
+    # Look for the markers on a downscaled copy of the page first, then detect them again at full resolution,
+    # but only in small crops around the candidates. Falls back to the search on the full page, if
+    # the coarse search does not find exactly two markers or a refinement fails.
+    small = cv2.resize(img, None, fx=downscale, fy=downscale, interpolation=cv2.INTER_AREA)
+    corners, ids = detect_markers(small)
+    if ids is None or len(ids) != 2:
+        return detect_markers(img)
+
+    refined_corners = []
+    refined_ids = []
+    height, width = img.shape[:2]
+    for candidate in corners:
+        candidate = candidate[0, :, :] / downscale
+        # the crop has a margin of one marker length around the candidate
+        margin = np.max(np.linalg.norm(candidate - np.roll(candidate, 1, axis=0), axis=1))
+        x0, y0 = np.maximum(np.floor(np.min(candidate, axis=0) - margin), 0).astype(int)
+        x1, y1 = np.ceil(np.max(candidate, axis=0) + margin).astype(int)
+        x1 = min(x1, width)
+        y1 = min(y1, height)
+        crop_corners, crop_ids = detect_markers(img[y0:y1, x0:x1])
+        if crop_ids is None or len(crop_ids) != 1:
+            return detect_markers(img)
+        refined_corners.append(crop_corners[0] + np.array([x0, y0], dtype=crop_corners[0].dtype))
+        refined_ids.append(crop_ids[0])
+    return refined_corners, np.array(refined_ids)
+
+
+def find_markers(img, downscale=0.5, timings=None):
+    # downscale=None searches the full page at full resolution
+    # the durations of the stages are added to the dict timings, if it is given
+    with timed(timings, 'marker detect'):
+        if downscale is None:
+            corners, ids = detect_markers(img)
+        else:
+            corners, ids = detect_markers_coarse_to_fine(img, downscale)
     if ids is None:
         raise MarkerException('There need to be exactly 2 markers, found 0')
     if len(ids) != 2:
         raise MarkerException('There need to be exactly 2 markers, found {}'.format(len(ids)))
-    for i in range(len(ids)):
-        check_marker_is_square(corners[i][0,:,:])
+    with timed(timings, 'square check'):
+        for i in range(len(ids)):
+            check_marker_is_square(corners[i][0,:,:])
     if ids[0] != 0 and ids[1] == 0:
         left_id = ids[0]
         left_marker = corners[0][0, :, :]
@@ -0,0 +1,56 @@
+import os
+import hashlib
+import logging
+import numpy as np
+
+import json_utils
+from pageid import PageId
+
+logger = logging.getLogger('medocr.'+__name__)
+
+
+def fingerprint(image):
+    # hash of the rendered page, either of the image file or of the pixels rendered in memory
+    if isinstance(image, str):
+        with open(image, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+    sha = hashlib.sha1(str(image.shape).encode())
+    sha.update(np.ascontiguousarray(image).data)
+    return sha.hexdigest()
+
+
+class FingerprintCache:
+    # For each file in the index, the fingerprints of its pages together with the page ids.
+    # Pages that were rendered to exactly the same image reuse the page id instead of being recognized again.
+    def __init__(self, path):
+        self._path = path
+        if os.path.isfile(path):
+            self._files = json_utils.read_json(path)
+        else:
+            self._files = dict()
+
+    def lookup(self):
+        known = dict()
+        for entries in self._files.values():
+            for entry in entries:
+                if entry is not None and entry[1] is not None:
+                    known[entry[0]] = PageId(entry[1])
+        return known
+
+    def set_file(self, file_name, num_pages):
+        self._files[file_name] = [None] * num_pages
+
+    def set_page(self, file_name, page_num, key, page_id):
+        if key is None:
+            return
+        # only valid ids are reused, everything else gets another chance
+        self._files[file_name][page_num] = [key, page_id.tuple() if page_id.is_valid() else None]
+
+    def relabel(self, file_name, page_num, page_id):
+        if file_name in self._files and self._files[file_name][page_num] is not None:
+            self.set_page(file_name, page_num, self._files[file_name][page_num][0], page_id)
+
+    def write(self, file_names):
+        # drop the files that are no longer in the index
+        self._files = {f: entries for f, entries in self._files.items() if f in file_names}
+        json_utils.write_json(self._files, self._path)
@@ -0,0 +1,175 @@
+import os
+import json
+import logging
+import numpy as np
+
+import json_utils
+from pageid import PageId, PageIdTable, ID_FIELDS
+
+logger = logging.getLogger('medocr.'+__name__)
+
+# The index is stored either as JSON (file name -> list of page ids) or in a binary format:
+# the magic line, the length of the header, a JSON header with the table of file names,
+# and one fixed size record per page. The records can be memory mapped and are only read when they are used.
+INDEX_FORMATS = ['json', 'binary']
+DEFAULT_INDEX_FORMAT = 'binary'
+MAGIC = b'MEDOCR-INDEX-V1\n'
+HEADER_LENGTH_DTYPE = np.dtype('<u8')
+ALIGNMENT = 16
+# the journal is moved to the index file when it holds the labels of this many pages
+JOURNAL_COMPACTION_PAGES = 5000
+RECORD_DTYPE = np.dtype([('file', '<i4'), ('file_page', '<i4'),
+                         ('exam', '<i4'), ('sheet', '<i4'), ('task', '<i4'), ('page', '<i4')])
+
+
+def index_format(path):
+    with open(path, 'rb') as file:
+        magic = file.read(len(MAGIC))
+    return 'binary' if magic == MAGIC else 'json'
+
+
+def index_to_records(file_names, index):
+    # index maps the file names to the PageIdTables of their pages
+    records = np.zeros(sum(len(index[f]) for f in file_names), dtype=RECORD_DTYPE)
+    start = 0
+    for file_num, file_name in enumerate(file_names):
+        table = index[file_name]
+        stop = start + len(table)
+        records['file'][start:stop] = file_num
+        records['file_page'][start:stop] = np.arange(len(table))
+        for field in ID_FIELDS:
+            records[field][start:stop] = table.column(field)
+        start = stop
+    return records
+
+
+def records_to_index(file_names, num_pages, records, mapped=False):
+    # the tables are views of the records, nothing is read before the pages are used
+    index = dict()
+    start = 0
+    for file_name, n in zip(file_names, num_pages):
+        index[file_name] = PageIdTable(columns=[records[field][start:start + n] for field in ID_FIELDS], mapped=mapped)
+        start += n
+    return index
+
+
+def read_index(path):
+    # Returns a dict from the file names to the PageIdTables of their pages.
+    # A binary index is memory mapped, a JSON index is read completely.
+    if index_format(path) == 'json':
+        index_s = json_utils.read_json(path)
+        return {file_name: PageIdTable.from_tuples(id_list) for file_name, id_list in index_s.items()}
+
+    with open(path, 'rb') as file:
+        file.read(len(MAGIC))
+        header_length = int(np.frombuffer(file.read(HEADER_LENGTH_DTYPE.itemsize), dtype=HEADER_LENGTH_DTYPE)[0])
+        header = json.loads(file.read(header_length).decode('utf-8'))
+    offset = len(MAGIC) + HEADER_LENGTH_DTYPE.itemsize + header_length
+    file_names = [f[0] for f in header['files']]
+    num_pages = [f[1] for f in header['files']]
+    if sum(num_pages) == 0:
+        return records_to_index(file_names, num_pages, np.zeros(0, dtype=RECORD_DTYPE))
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=offset, shape=(sum(num_pages),))
+    return records_to_index(file_names, num_pages, records, mapped=True)
+
+
+def write_index(index, path, index_format=DEFAULT_INDEX_FORMAT):
+    # index maps the file names to the PageIdTables of their pages
+    if index_format not in INDEX_FORMATS:
+        raise ValueError('The index format must be one of {}, got {}'.format(INDEX_FORMATS, index_format))
+    # the file that is replaced may still be mapped
+    for table in index.values():
+        table.load()
+    if index_format == 'json':
+        json_utils.write_json({file_name: table.tuples() for file_name, table in index.items()}, path)
+        return
+
+    file_names = list(index.keys())
+    records = index_to_records(file_names, index)
+    header = json.dumps({'files': [[f, len(index[f])] for f in file_names]}).encode('utf-8')
+    # pad the header, so that the records start at an aligned offset
+    header_start = len(MAGIC) + HEADER_LENGTH_DTYPE.itemsize
+    header += b' ' * (-(header_start + len(header)) % ALIGNMENT)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(np.array([len(header)], dtype=HEADER_LENGTH_DTYPE).tobytes())
+        file.write(header)
+        file.write(records.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+
+def apply_journal_entry(index, entry):
+    # the entries set absolute values, applying an entry twice does no harm
+    op = entry['op']
+    if op == 'set_page':
+        if entry['file'] in index:
+            index[entry['file']][entry['page']] = PageId(entry['id'])
+    elif op == 'set_file':
+        index[entry['file']] = PageIdTable.from_tuples(entry['ids'])
+    elif op == 'remove_file':
+        index.pop(entry['file'], None)
+    else:
+        raise ValueError('Unknown operation {} in the index journal.'.format(op))
+
+
+class IndexJournal:
+    # Append only log of the changes to the index since the index file was written the last time.
+    # Each change is one line of JSON and is on the disk when the call returns.
+    # A checkpoint writes the whole index (atomically) and starts a new journal.
+    def __init__(self, path):
+        self._path = path
+        # number of pages changed in the journal
+        self.changed_pages = 0
+        self._checked_line_end = False
+
+    def replay(self, index):
+        if not os.path.isfile(self._path):
+            return
+        with open(self._path, 'r') as file:
+            lines = file.read().split('\n')
+        num_entries = 0
+        for line_num, line in enumerate(lines):
+            if line.strip() == '':
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last write was interrupted
+                logger.warning('Ignoring the incomplete line %d of the index journal %s.', line_num + 1, self._path)
+                continue
+            apply_journal_entry(index, entry)
+            self.changed_pages += len(entry.get('ids', [None]))
+            num_entries += 1
+        logger.info('Applied %d changes from the index journal.', num_entries)
+
+    def append(self, entry):
+        with open(self._path, 'a') as file:
+            if not self._checked_line_end:
+                # an interrupted write may have left an incomplete line behind
+                if file.tell() > 0:
+                    file.write('\n')
+                self._checked_line_end = True
+            file.write(json.dumps(entry) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.changed_pages += len(entry.get('ids', [None]))
+
+    def set_page(self, file_name, page_num, page_id):
+        self.append({'op': 'set_page', 'file': file_name, 'page': page_num, 'id': page_id.tuple()})
+
+    def set_file(self, file_name, table):
+        self.append({'op': 'set_file', 'file': file_name, 'ids': table.tuples()})
+
+    def remove_file(self, file_name):
+        self.append({'op': 'remove_file', 'file': file_name})
+
+    def clear(self):
+        if os.path.isfile(self._path):
+            os.remove(self._path)
+        self.changed_pages = 0
+        self._checked_line_end = True
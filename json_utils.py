@@ -1,3 +1,4 @@
+import os
 import json
 
 
@@ -8,5 +9,11 @@ def read_json(filename):
 
 
 def write_json(data, filename):
-    with open(filename, 'w') as f:
+    # write to a temporary file first and replace the original in one step,
+    # so that an interrupted write does not leave a corrupt file behind
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
         json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
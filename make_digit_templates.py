@@ -0,0 +1,20 @@
+import argparse
+
+from recognition import PageRecognizer
+from digits import get_digit_classifier
+from ocr import OCR_BACKENDS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Learn the digit templates of the built in classifier from page images. '
+                                                 'Only fields that tesseract reads with a valid checksum are used.')
+    parser.add_argument('files', nargs='+', help='The page images.')
+    parser.add_argument('--output', '-o', default='digits.npz', help='The template file.')
+    parser.add_argument('--ocr', choices=OCR_BACKENDS, default='auto', help='The OCR backend.')
+    args = parser.parse_args()
+
+    recognizer = PageRecognizer(ocr_backend=args.ocr)
+    for file_name in args.files:
+        recognizer.recognize(file_name)
+    classifier = get_digit_classifier(None)
+    classifier.save(args.output)
+    print('Saved {} templates to {}'.format(classifier.num_templates(), args.output))
@@ -0,0 +1,183 @@
+import os
+import copy
+import zlib
+import logging
+import PyPDF2
+from PyPDF2.generic import NameObject, ArrayObject, DictionaryObject, DecodedStreamObject, EncodedStreamObject, \
+    NumberObject
+
+logger = logging.getLogger('medocr.'+__name__)
+
+# the name of the exam page in the resources of the marked pages
+EXAM_FORM = '/MedocrExam'
+
+
+def content_data(page):
+    # the decoded content streams of the page, joined into one
+    if '/Contents' not in page:
+        return b''
+    contents = page['/Contents']
+    streams = [c.getObject() for c in contents] if isinstance(contents, ArrayObject) else [contents]
+    return b'\n'.join(stream.getData() for stream in streams)
+
+
+def add_stream(writer, stream, encoded_data=None):
+    # PyPDF2 has no public API to add an object that is not a page to a writer, or to give a stream data that is
+    # already encoded. Both go through its private _addObject and _data here, and nowhere else.
+    if encoded_data is not None:
+        stream._data = encoded_data
+    return writer._addObject(stream)
+
+
+def content_refs(page):
+    contents = page.raw_get('/Contents')
+    if isinstance(contents, ArrayObject):
+        return list(contents)
+    return [contents]
+
+
+class MarkedExam:
+    # Puts the mark pages on top of the pages of the exam. Each exam page becomes a form XObject: its content
+    # streams are decoded and compressed once per process, and every marked page only draws the form and adds
+    # the content of its mark page. Within one output file, each exam page is stored only once.
+    # With merge_pages, the pages are merged with PyPDF2's mergePage instead, like before.
+    def __init__(self, exam_path, marks_path, merge_pages=False):
+        self.merge_pages = merge_pages
+        self._exam_file = open(exam_path, 'rb')
+        self._marks_file = open(marks_path, 'rb')
+        self._exam = PyPDF2.PdfFileReader(self._exam_file)
+        self._marks = PyPDF2.PdfFileReader(self._marks_file)
+        self.num_exam_pages = self._exam.numPages
+        self.num_marks = self._marks.numPages
+        # the compressed content of each exam page, made when it is first used
+        self._form_data = [None] * self.num_exam_pages
+
+    def exam_page(self, exam_page_num):
+        return self._exam.getPage(exam_page_num)
+
+    def mark_page(self, mark_num):
+        return self._marks.getPage(mark_num)
+
+    def form_data(self, exam_page_num):
+        if self._form_data[exam_page_num] is None:
+            page = self.exam_page(exam_page_num)
+            self._form_data[exam_page_num] = zlib.compress(content_data(page))
+        return self._form_data[exam_page_num]
+
+    def new_output(self):
+        return MarkedPdf(self)
+
+    def close(self):
+        self._exam_file.close()
+        self._marks_file.close()
+
+
+class MarkedPdf:
+    # one output file, the forms of the exam pages are added to it when they are first used
+    def __init__(self, exam):
+        self._exam = exam
+        self._writer = PyPDF2.PdfFileWriter()
+        self._forms = dict()
+        self._draw_form = None
+        self.num_pages = 0
+
+    def form(self, exam_page_num):
+        if exam_page_num not in self._forms:
+            page = self._exam.exam_page(exam_page_num)
+            form = EncodedStreamObject()
+            form[NameObject('/Filter')] = NameObject('/FlateDecode')
+            form[NameObject('/Type')] = NameObject('/XObject')
+            form[NameObject('/Subtype')] = NameObject('/Form')
+            form[NameObject('/BBox')] = ArrayObject(page.mediaBox)
+            form[NameObject('/Matrix')] = ArrayObject([NumberObject(v) for v in [1, 0, 0, 1, 0, 0]])
+            if '/Resources' in page:
+                form[NameObject('/Resources')] = page.raw_get('/Resources')
+            self._forms[exam_page_num] = add_stream(self._writer, form, self._exam.form_data(exam_page_num))
+        return self._forms[exam_page_num]
+
+    def draw_form(self):
+        # the content stream that draws the exam page, the same for all pages
+        if self._draw_form is None:
+            stream = DecodedStreamObject()
+            stream.setData('q {} Do Q\n'.format(EXAM_FORM).encode('ascii'))
+            self._draw_form = add_stream(self._writer, stream)
+        return self._draw_form
+
+    def marked_page(self, exam_page_num, mark_page):
+        exam_page = self._exam.exam_page(exam_page_num)
+        page = copy.copy(exam_page)
+        if self._exam.merge_pages:
+            page.mergePage(mark_page)
+            return page
+        resources = DictionaryObject()
+        mark_resources = mark_page['/Resources'] if '/Resources' in mark_page else DictionaryObject()
+        resources.update(dict(mark_resources.items()))
+        xobjects = DictionaryObject()
+        if '/XObject' in mark_resources:
+            xobjects.update(dict(mark_resources['/XObject'].items()))
+        xobjects[NameObject(EXAM_FORM)] = self.form(exam_page_num)
+        resources[NameObject('/XObject')] = xobjects
+        page[NameObject('/Resources')] = resources
+        contents = [self.draw_form()]
+        if '/Contents' in mark_page:
+            contents += content_refs(mark_page)
+        page[NameObject('/Contents')] = ArrayObject(contents)
+        return page
+
+    def add_sheet(self, mark_num):
+        # all pages of the exam, marked with the mark page mark_num
+        mark_page = self._exam.mark_page(mark_num)
+        for exam_page_num in range(self._exam.num_exam_pages):
+            self._writer.addPage(self.marked_page(exam_page_num, mark_page))
+            self.num_pages += 1
+
+    def write(self, out_path):
+        with open(out_path, 'wb') as out_file:
+            self._writer.write(out_file)
+
+
+def sheet_file_name(exam_name, mark_nums):
+    if len(mark_nums) == 1:
+        return '{0}_{1:03d}.pdf'.format(exam_name, mark_nums[0])
+    return '{0}_{1:03d}_{2:03d}.pdf'.format(exam_name, mark_nums[0], mark_nums[-1])
+
+
+def split_files(num_marks, bundle_size=1):
+    # the mark pages of each output file
+    return [list(range(start, min(start + bundle_size, num_marks))) for start in range(0, num_marks, bundle_size)]
+
+
+# the exam and marks of each (worker) process, they stay open for all output files the process writes
+_exams = dict()
+
+
+def get_exam(exam_path, marks_path, merge_pages=False):
+    key = (exam_path, marks_path, merge_pages)
+    if key not in _exams:
+        _exams[key] = MarkedExam(exam_path, marks_path, merge_pages)
+    return _exams[key]
+
+
+def close_exams():
+    for exam in _exams.values():
+        exam.close()
+    _exams.clear()
+
+
+def write_files(task):
+    # Runs in the worker processes. task is (exam path, marks path, merge pages, output folder, exam name, files),
+    # files is a list with the numbers of the mark pages of each output file.
+    exam_path, marks_path, merge_pages, out_folder, exam_name, files = task
+    exam = get_exam(exam_path, marks_path, merge_pages)
+    for mark_nums in files:
+        out_pdf = exam.new_output()
+        for mark_num in mark_nums:
+            out_pdf.add_sheet(mark_num)
+        out_pdf.write(os.path.join(out_folder, sheet_file_name(exam_name, mark_nums)))
+    return sum(len(mark_nums) for mark_nums in files)
+
+
+def split_tasks(files, jobs):
+    # a few chunks per process, so that the processes finish at about the same time
+    chunk_size = max(1, len(files) // (4 * jobs))
+    return [files[start:start + chunk_size] for start in range(0, len(files), chunk_size)]
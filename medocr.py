@@ -6,6 +6,12 @@ import os_utils
 from defaultlogger import set_default_logging_behavior
 
 from collection import Collection
+from rendering import PageRenderer
+from recognition import PageRecognizer
+from ocr import OCR_BACKENDS
+from index_store import INDEX_FORMATS
+from page_store import PREVIEW_DPI, DEFAULT_MAX_BYTES
+import profiling
 logger = logging.getLogger('medocr.main')
 
 
@@ -25,6 +31,16 @@ def find_free_path(raw_path):
     return full_path
 
 
+def parse_band(value):
+    # 'auto' or x,y,width,height in millimeters
+    if value == 'auto':
+        return value
+    band = [float(v) for v in value.split(',')]
+    if len(band) != 4:
+        raise argparse.ArgumentTypeError('The band must be "auto" or x,y,width,height in mm, got {}'.format(value))
+    return tuple(band)
+
+
 def find_most_recent_log_number(path):
     logfiles = [name_ext for name_ext in os.listdir(path)
                 if name_ext.startswith('medocr')
@@ -63,6 +79,15 @@ if __name__ == '__main__':
                                                       'Pages can be grouped by task id (for the correctors) or by sheet id (for the students)\n')
 
     main_parser.add_argument('collection', help='The collection to work on.')
+    main_parser.add_argument('--index-format', choices=INDEX_FORMATS, default=None,
+                             help='The format the index is written in. Collections with a JSON index are read as well '
+                                  'and are upgraded to the binary format, unless json is selected.')
+
+    main_parser.add_argument('--profile', action='store_true',
+                             help='Measure the time of each stage of the page recognition and print a summary.')
+    main_parser.add_argument('--profile-trace', default=None,
+                             help='Write the time of each stage and page to this file (.json or .csv), '
+                                  'implies --profile.')
 
     subparsers = main_parser.add_subparsers(dest='mode', title='Subcommands',
                                             description='Select one of the following operations:')
@@ -75,28 +100,76 @@ if __name__ == '__main__':
     validate_parser = subparsers.add_parser('validate', parents=[parent_parser], conflict_handler='resolve',
                                             help='Validate the collection.')
 
-    add_parser.add_argument('file', help='The .pdf file to be added.')
+    add_parser.add_argument('files', nargs='+',
+                            help='The .pdf files to be added. Folders add all .pdf files inside them.')
+    add_parser.add_argument('--jobs', '-j', type=int, default=1,
+                            help='Number of worker processes for the page recognition (0 = one per core).')
+    add_parser.add_argument('--window-size', '-ws', type=int, default=20,
+                            help='Number of pages that are converted to images at once.')
+    add_parser.add_argument('--in-memory', action='store_true',
+                            help='Keep the converted pages in memory instead of writing them to the work folder.')
+    add_parser.add_argument('--dpi', type=int, default=200,
+                            help='Resolution at which the pages are converted to images.')
+    add_parser.add_argument('--retry-dpi', type=int, default=None,
+                            help='Convert the pages that are not recognized again at this resolution. '
+                                 'If the markers were found, only the strip with the markers is converted.')
+    add_parser.add_argument('--band', type=parse_band, default=None,
+                            help='Only convert the band of the pages with the markers and the fields: "auto" finds it '
+                                 'on the first page of each file, or x,y,width,height in mm from the top left corner. '
+                                 'Pages without markers in the band are converted completely.')
+    add_parser.add_argument('--ocr', choices=OCR_BACKENDS, default='auto',
+                            help='The OCR backend. tesserocr keeps tesseract loaded between the fields, pytesseract '
+                                 'starts a new tesseract process for each field. auto prefers tesserocr, if installed.')
+    add_parser.add_argument('--ocr-batch', type=int, default=0,
+                            help='Read the fields of this many pages with a single OCR call (0 = one call per field).')
+    add_parser.add_argument('--no-digit-classifier', action='store_true',
+                            help='Read all fields with tesseract instead of the built in classifier for printed digits.')
+    add_parser.add_argument('--digit-templates', default=None,
+                            help='Start the digit classifier with the templates from this file '
+                                 '(see make_digit_templates.py).')
+    add_parser.add_argument('--recognize-all', action='store_true',
+                            help='Recognize all pages again, even the ones that are identical to known pages.')
+    add_parser.add_argument('--page-store', action='store_true',
+                            help='Keep previews of the pages and their marker strips for the validation.')
+    add_parser.add_argument('--page-store-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                            help='Maximum size of the stored previews in MB, the least recently used ones are deleted '
+                                 '(with --page-store).')
     remove_parser.add_argument('file', help='The file to be removed from the collection.')
 
     order_parser.add_argument('by', choices=['sheet', 'task'], help='The order criterion.')
     order_parser.add_argument('--to', help='The folder containing the rearranged collection.', default=None)
     order_parser.add_argument('--chunk-size', '-cs', type=int, default=0,
                               help='Split the output files into chunks of this size')
+    order_parser.add_argument('--jobs', '-j', type=int, default=1,
+                              help='Number of worker processes writing the output files (0 = one per core).')
+    order_parser.add_argument('--max-open-files', type=int, default=256,
+                              help='Maximum number of source files that are open at once, shared by all processes.')
 
     validate_parser.add_argument('--extra-pages', '-xp', nargs='+', type=int, default=(),
                                  help='Exclude extra pages from the check for missing pages.')
     args = main_parser.parse_args()
+    if args.profile or args.profile_trace is not None:
+        profiling.enable()
 
     try:
         if args.mode == 'add':
-            collection = Collection.make_or_read_collection(args.collection)
-            os_utils.validate_file_name(args.file, 'pdf')
-            collection.add_pdf(args.file, 'ask')
+            collection = Collection.make_or_read_collection(args.collection, args.index_format)
+            files = os_utils.expand_file_list(args.files, 'pdf')
+            renderer = PageRenderer(dpi=args.dpi, window_size=args.window_size, in_memory=args.in_memory,
+                                    retry_dpi=args.retry_dpi, band=args.band)
+            recognizer = PageRecognizer(ocr_backend=args.ocr, ocr_batch_pages=args.ocr_batch,
+                                        digit_classifier=not args.no_digit_classifier,
+                                        digit_templates=args.digit_templates,
+                                        preview_scale=PREVIEW_DPI / renderer.dpi if args.page_store else None,
+                                        profile=profiling.is_enabled())
+            collection.add_pdfs(files, 'ask', jobs=args.jobs, renderer=renderer, recognizer=recognizer,
+                                reuse_known_pages=not args.recognize_all,
+                                page_store_size=args.page_store_size * 1024 * 1024)
         elif args.mode == 'remove':
-            collection = Collection(args.collection)
+            collection = Collection(args.collection, args.index_format)
             collection.remove(args.file)
         elif args.mode == 'order-by':
-            collection = Collection(args.collection)
+            collection = Collection(args.collection, args.index_format)
 
             if args.to is None:
                 parent_folder, collection_name = os.path.split(os.path.realpath(args.collection))
@@ -104,9 +177,10 @@ if __name__ == '__main__':
             else:
                 dest = args.to
             dest = find_free_path(dest)
-            new_collection = collection.reorder_by(args.by, dest, chunk_size=args.chunk_size)
+            new_collection = collection.reorder_by(args.by, dest, chunk_size=args.chunk_size, jobs=args.jobs,
+                                                  max_open_files=args.max_open_files)
         elif args.mode == 'validate':
-            collection = Collection(args.collection)
+            collection = Collection(args.collection, args.index_format)
             collection.validate(args.extra_pages)
         else:
             main_parser.print_usage()
@@ -114,4 +188,6 @@ if __name__ == '__main__':
     except Exception as ex:
         logger.critical('', exc_info=ex)
         sys.exit(1)
+    finally:
+        profiling.report(args.profile_trace)
     sys.exit(0)
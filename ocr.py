@@ -0,0 +1,154 @@
+import logging
+import numpy as np
+import cv2
+import pytesseract
+
+from pageid import get_number_from_ocr_string, remove_whitespace
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger('medocr.'+__name__)
+
+TESSERACT_OPTIONS = r'--oem 3 --psm 6 outputbase digits'
+OCR_BACKENDS = ['auto', 'tesserocr', 'pytesseract']
+
+
+class PytesseractBackend:
+    # Starts one tesseract process per call.
+    name = 'pytesseract'
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, config=TESSERACT_OPTIONS)
+
+    def image_to_words(self, image):
+        data = pytesseract.image_to_data(image, config=TESSERACT_OPTIONS, output_type=pytesseract.Output.DICT)
+        words = []
+        for text, left, top, width, height in zip(data['text'], data['left'], data['top'],
+                                                  data['width'], data['height']):
+            if text.strip() != '':
+                words.append((text, left, top, width, height))
+        return words
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend:
+    # Keeps one tesseract instance with the loaded model alive and reuses it for all fields.
+    name = 'tesserocr'
+
+    def __init__(self):
+        if tesserocr is None:
+            raise RuntimeError('The OCR backend tesserocr is not installed.')
+        # the same settings as TESSERACT_OPTIONS: default engine, a single uniform block of text, only digits
+        self._api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.DEFAULT)
+        self._api.SetVariable('tessedit_char_whitelist', '0123456789-.')
+
+    def set_image(self, image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        self._api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+
+    def image_to_string(self, image):
+        self.set_image(image)
+        return self._api.GetUTF8Text()
+
+    def image_to_words(self, image):
+        self.set_image(image)
+        self._api.Recognize()
+        level = tesserocr.RIL.WORD
+        words = []
+        for word in tesserocr.iterate_level(self._api.GetIterator(), level):
+            text = word.GetUTF8Text(level)
+            box = word.BoundingBox(level)
+            if text is not None and text.strip() != '' and box is not None:
+                words.append((text, box[0], box[1], box[2] - box[0], box[3] - box[1]))
+        return words
+
+    def close(self):
+        self._api.End()
+
+
+def tile_fields(fields):
+    # Stacks the fields below each other, separated by white bands of one field height,
+    # so that each field becomes one line of text. Returns the tile and the height of a row.
+    fields = [f if f.ndim == 2 else cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in fields]
+    height = max(f.shape[0] for f in fields)
+    width = max(f.shape[1] for f in fields)
+    row_height = 2 * height
+    tile = np.full((len(fields) * row_height + height, width + 2 * height), 255, dtype=np.uint8)
+    for i, field in enumerate(fields):
+        top = height + i * row_height
+        tile[top:top + field.shape[0], height:height + field.shape[1]] = field
+    return tile, row_height
+
+
+def read_fields_batched(backend, fields):
+    # One OCR call for all fields. The words are assigned to the fields by the row their center lies in,
+    # empty fields simply get no words.
+    if len(fields) == 0:
+        return []
+    tile, row_height = tile_fields(fields)
+    words_by_field = [[] for f in fields]
+    for text, left, top, width, height in backend.image_to_words(tile):
+        # field i covers the pixel rows from (2i+1)/2 to (2i+2)/2 row heights,
+        # shifting by a quarter row height centers the field in its interval
+        center = top + height / 2.
+        row = int((center - row_height / 4.) // row_height)
+        row = min(max(row, 0), len(fields) - 1)
+        words_by_field[row].append((left, text))
+    return [' '.join(text for left, text in sorted(words)) for words in words_by_field]
+
+
+def read_fields(backend, fields, batched=False, classifier=None):
+    # The digit classifier reads the fields it is sure about, the checksum decides whether its reading is accepted.
+    # All other fields go to tesseract, also the ones that look blank: faint handwriting in an empty task field
+    # must not turn the page into an empty page. The fields tesseract reads with a valid checksum
+    # become new templates of the classifier.
+    ocr_strings = [None] * len(fields)
+    if classifier is not None:
+        for i, field in enumerate(fields):
+            text = classifier.read_field(field)
+            if text is not None and get_number_from_ocr_string(text) is not None:
+                ocr_strings[i] = text
+
+    remaining = [i for i, text in enumerate(ocr_strings) if text is None]
+    if len(remaining) < len(fields):
+        logger.debug('The digit classifier read %d of %d fields.', len(fields) - len(remaining), len(fields))
+    remaining_fields = [fields[i] for i in remaining]
+    if batched:
+        texts = read_fields_batched(backend, remaining_fields)
+    else:
+        texts = [backend.image_to_string(f) for f in remaining_fields]
+    for i, text in zip(remaining, texts):
+        ocr_strings[i] = text
+        if classifier is not None and get_number_from_ocr_string(text) is not None:
+            classifier.learn(fields[i], remove_whitespace(text))
+    return ocr_strings
+
+
+def make_ocr_backend(name='auto'):
+    if name == 'auto':
+        name = 'tesserocr' if tesserocr is not None else 'pytesseract'
+    if name == 'tesserocr':
+        return TesserocrBackend()
+    if name == 'pytesseract':
+        return PytesseractBackend()
+    raise ValueError('The OCR backend must be one of {}, got {}'.format(OCR_BACKENDS, name))
+
+
+# one instance per backend and process, they live as long as the (worker) process
+_backends = dict()
+
+
+def get_ocr_backend(name='auto'):
+    if name not in _backends:
+        _backends[name] = make_ocr_backend(name)
+        logger.debug('Using the OCR backend %s.', _backends[name].name)
+    return _backends[name]
@@ -1,4 +1,5 @@
 import os
+import glob
 import logging
 
 
@@ -85,4 +86,22 @@ def clear_files_with_extension(folder, extension):
     for item in files:
         item_name, item_ext = os.path.splitext(item)
         if item_ext == '.'+extension:
-            os.remove(os.path.join(folder, item))
\ No newline at end of file
+            os.remove(os.path.join(folder, item))
+
+
+def expand_file_list(paths, extension):
+    # paths may be files, folders (all files with the extension inside) or glob patterns
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.' + extension))))
+        elif not os.path.isfile(path) and any(c in path for c in '*?['):
+            matches = sorted(glob.glob(path))
+            if len(matches) == 0:
+                raise FileNotFoundError('No files match the pattern {}'.format(path))
+            files.extend(matches)
+        else:
+            files.append(path)
+    for file_name in files:
+        validate_file_name(file_name, extension)
+    return files
@@ -0,0 +1,114 @@
+import os
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+logger = logging.getLogger('medocr.'+__name__)
+
+# the previews have the resolution of the pages shown in the validation
+PREVIEW_DPI = 100
+STRIP_HEIGHT = 48
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+PREVIEW_SUFFIX = '.preview.jpg'
+STRIP_SUFFIX = '.strip.png'
+
+
+def encode_preview(image, scale):
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+
+def encode_strip(strip):
+    scale = min(1., STRIP_HEIGHT / strip.shape[0])
+    small = cv2.resize(strip, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.png', small)[1].tobytes()
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+class PageImageStore:
+    # Small images of the pages of a collection, made when the pages are recognized: a preview of the whole page
+    # and the strip with the markers and the fields. The validation shows the previews instead of rendering
+    # the pages from the pdf again. Each file of the collection has its own folder.
+    # When the store grows beyond max_bytes, the images that were used least recently are deleted.
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES):
+        self._folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # path -> size, in the order of the last use
+        self._sizes = None
+
+    def _load_sizes(self):
+        if self._sizes is not None:
+            return
+        images = []
+        if os.path.isdir(self._folder):
+            for file_folder in os.listdir(self._folder):
+                for name in os.listdir(os.path.join(self._folder, file_folder)):
+                    stat = os.stat(os.path.join(self._folder, file_folder, name))
+                    images.append((stat.st_mtime, os.path.join(file_folder, name), stat.st_size))
+        self._sizes = OrderedDict((path, size) for mtime, path, size in sorted(images))
+
+    @staticmethod
+    def image_path(file_name, page_num, suffix):
+        return os.path.join(file_name, '{:05d}{}'.format(page_num, suffix))
+
+    def put(self, file_name, page_num, preview=None, strip=None):
+        # preview and strip are encoded images, see encode_preview and encode_strip
+        with self._lock:
+            self._load_sizes()
+            os.makedirs(os.path.join(self._folder, file_name), exist_ok=True)
+            for data, suffix in [(preview, PREVIEW_SUFFIX), (strip, STRIP_SUFFIX)]:
+                if data is None:
+                    continue
+                path = PageImageStore.image_path(file_name, page_num, suffix)
+                with open(os.path.join(self._folder, path), 'wb') as file:
+                    file.write(data)
+                self._sizes.pop(path, None)
+                self._sizes[path] = len(data)
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        while total > self.max_bytes and len(self._sizes) > 0:
+            path, size = self._sizes.popitem(last=False)
+            total -= size
+            if os.path.isfile(os.path.join(self._folder, path)):
+                os.remove(os.path.join(self._folder, path))
+
+    def get(self, file_name, page_num, suffix):
+        path = PageImageStore.image_path(file_name, page_num, suffix)
+        with self._lock:
+            self._load_sizes()
+            if path not in self._sizes:
+                return None
+            full_path = os.path.join(self._folder, path)
+            # the folder of the store may have been deleted, then the page is rendered from the pdf
+            if not os.path.isfile(full_path):
+                self._sizes.pop(path)
+                return None
+            self._sizes.move_to_end(path)
+            # the modification time keeps the order of the last use for the next session
+            os.utime(full_path)
+            with open(full_path, 'rb') as file:
+                data = file.read()
+        return decode(data)
+
+    def preview(self, file_name, page_num):
+        return self.get(file_name, page_num, PREVIEW_SUFFIX)
+
+    def strip(self, file_name, page_num):
+        return self.get(file_name, page_num, STRIP_SUFFIX)
+
+    def remove_file(self, file_name):
+        with self._lock:
+            self._load_sizes()
+            for path in [p for p in self._sizes.keys() if os.path.dirname(p) == file_name]:
+                self._sizes.pop(path)
+            if os.path.isdir(os.path.join(self._folder, file_name)):
+                shutil.rmtree(os.path.join(self._folder, file_name))
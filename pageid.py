@@ -1,3 +1,11 @@
+from collections import OrderedDict
+import numpy as np
+
+ID_FIELDS = ['exam', 'sheet', 'task', 'page']
+# stands for a part of a page id that is unknown, e.g. because it could not be read
+MISSING = np.iinfo(np.int32).min
+
+
 def compute_checksum(number):
     if not isinstance(number, int) or number < 0 or number > 999:
         raise ValueError('Checksums are only defined for three-digit positive integers, got {}'.format(number))
@@ -52,6 +60,8 @@ def page_id_from_ocr(exam_id, ocr_strings):
 
 
 class PageId:
+    __slots__ = ('exam', 'sheet', 'task', 'page')
+
     def __init__(self, data=None):
         self.exam = None
         self.sheet = None
@@ -79,4 +89,88 @@ class PageId:
         return 'Klausur {}, Bogen {}, Aufgabe {}, Seite {}'.format(self.exam, self.sheet, self.task, self.page)
 
 
-
+def to_column_value(value):
+    return MISSING if value is None else value
+
+
+def from_column_value(value):
+    return None if value == MISSING else int(value)
+
+
+class PageIdTable:
+    # The page ids of many pages, stored in one typed array per field instead of one object per page.
+    # Indexing returns a new PageId with the fields of the page, assigning a PageId stores its fields.
+    def __init__(self, num_pages=0, columns=None, mapped=False):
+        if columns is None:
+            columns = [np.full(num_pages, MISSING, dtype=np.int32) for field in ID_FIELDS]
+        self._columns = columns
+        # the columns are read only views of a memory mapped index file
+        self._mapped = mapped
+
+    @staticmethod
+    def from_tuples(tuples):
+        table = PageIdTable(len(tuples))
+        for i, column in enumerate(table._columns):
+            column[:] = [MISSING if t is None or t[i] is None else t[i] for t in tuples]
+        return table
+
+    @staticmethod
+    def from_page_ids(page_ids):
+        return PageIdTable.from_tuples([None if pid is None else pid.tuple() for pid in page_ids])
+
+    @staticmethod
+    def concatenate(tables):
+        if len(tables) == 0:
+            return PageIdTable()
+        return PageIdTable(columns=[np.concatenate([t._columns[i] for t in tables]) for i in range(len(ID_FIELDS))])
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def __getitem__(self, i):
+        return PageId([from_column_value(column[i]) for column in self._columns])
+
+    def __setitem__(self, i, page_id):
+        self.load()
+        values = PageId().tuple() if page_id is None else page_id.tuple()
+        for column, value in zip(self._columns, values):
+            column[i] = to_column_value(value)
+
+    def __iter__(self):
+        return (PageId(t) for t in self.tuples())
+
+    def load(self):
+        # copies the columns of a memory mapped index, before they are changed
+        if self._mapped:
+            self._columns = [np.array(column, dtype=np.int32) for column in self._columns]
+            self._mapped = False
+
+    def tuples(self):
+        columns = [[None if v == MISSING else v for v in column.tolist()] for column in self._columns]
+        return list(zip(*columns))
+
+    def column(self, field):
+        return self._columns[ID_FIELDS.index(field)]
+
+    def valid(self):
+        return np.all([column != MISSING for column in self._columns], axis=0)
+
+    def filter(self, mask):
+        return PageIdTable(columns=[column[mask] for column in self._columns])
+
+    def argsort(self, fields):
+        # stable, the first field is the primary key
+        if len(fields) == 0:
+            return np.arange(len(self))
+        return np.lexsort([self.column(field) for field in reversed(fields)])
+
+    def group_by(self, field):
+        # the rows of each value of the field, in the order in which the values first appear
+        values = self.column(field)
+        keys, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        rows = np.split(order, np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1])
+        groups = OrderedDict()
+        for k in np.argsort(first):
+            groups[from_column_value(keys[k])] = rows[k]
+        return groups
@@ -0,0 +1,97 @@
+import os
+import multiprocessing
+import threading
+import queue
+import logging
+
+logger = logging.getLogger('medocr.'+__name__)
+
+
+class SerialPool:
+    # Stand-in for multiprocessing.Pool that runs everything in the calling process.
+    # Keeps the single job case free of pickling and process start-up costs.
+    def imap(self, func, iterable, chunksize=1):
+        return map(func, iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def number_of_jobs(jobs):
+    if jobs is None:
+        return 1
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def make_pool(jobs, initializer=None):
+    jobs = number_of_jobs(jobs)
+    if jobs == 1:
+        return SerialPool()
+    logger.debug('Starting a pool of %d worker processes.', jobs)
+    return multiprocessing.Pool(jobs, initializer=initializer)
+
+
+def make_side_pool(jobs, initializer=None):
+    # A few processes next to a pool of `jobs` processes, for tasks that must not wait behind the tasks
+    # already queued in that pool. With a single job, everything runs in the calling process anyway.
+    jobs = number_of_jobs(jobs)
+    if jobs == 1:
+        return SerialPool()
+    side_jobs = max(1, jobs // 4)
+    logger.debug('Starting a side pool of %d worker processes.', side_jobs)
+    return multiprocessing.Pool(side_jobs, initializer=initializer)
+
+
+class Prefetcher:
+    # Runs an iterator in a background thread and keeps at most `depth` of its items ready,
+    # so that producing the next item overlaps with consuming the current one.
+    _done = object()
+
+    def __init__(self, iterable, depth=1):
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(iter(iterable),), daemon=True)
+        self._thread.start()
+
+    def _run(self, iterator):
+        try:
+            for item in iterator:
+                if not self._put((True, item)):
+                    return
+        except Exception as ex:
+            self._put((False, ex))
+            return
+        finally:
+            # lets a generator clean up, also when the consumer stopped early
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        self._put((True, Prefetcher._done))
+
+    def _put(self, entry):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        try:
+            while True:
+                ok, item = self._queue.get()
+                if not ok:
+                    raise item
+                if item is Prefetcher._done:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,154 @@
+import os
+import logging
+from collections import OrderedDict
+import PyPDF2
+
+logger = logging.getLogger('medocr.'+__name__)
+
+
+class SourcePdfs:
+    # Opens and parses each source pdf only once. The parsed pages are shared by all output files.
+    # At most max_open source files are kept open; when another one is needed, the least recently used
+    # file that is not pinned is closed.
+    def __init__(self, folder, max_open=None):
+        if max_open is not None and max_open < 2:
+            raise ValueError('At least 2 source files must be allowed to be open at once, got {}'.format(max_open))
+        self._folder = folder
+        self.max_open = max_open
+        # file name -> (file, reader), in the order of the last use
+        self._open = OrderedDict()
+        self._pinned = set()
+
+    def reader(self, file_name):
+        if file_name in self._open:
+            self._open.move_to_end(file_name)
+        else:
+            self._make_room()
+            logger.debug('Opening source file %s', file_name)
+            in_file = open(os.path.join(self._folder, file_name), 'rb')
+            self._open[file_name] = (in_file, PyPDF2.PdfFileReader(in_file))
+        return self._open[file_name][1]
+
+    def _make_room(self):
+        if self.max_open is None:
+            return
+        for file_name in list(self._open.keys()):
+            if len(self._open) < self.max_open:
+                return
+            if file_name not in self._pinned:
+                self.release(file_name)
+        if len(self._open) >= self.max_open:
+            raise RuntimeError('All {} open source files are pinned.'.format(len(self._open)))
+
+    def page(self, file_name, page_num):
+        return self.reader(file_name).getPage(page_num)
+
+    def pin(self, file_names):
+        # pinned files stay open, a writer reads from its sources until it is written
+        self._pinned = set(file_names)
+
+    def unpin(self):
+        self._pinned = set()
+
+    def release(self, file_name):
+        if file_name in self._open:
+            logger.debug('Closing source file %s', file_name)
+            in_file, reader = self._open.pop(file_name)
+            in_file.close()
+
+    def close(self):
+        for file_name in list(self._open.keys()):
+            self.release(file_name)
+        self._pinned = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def source_files(page_addresses):
+    return list(OrderedDict.fromkeys(file_name for file_name, page_num in page_addresses))
+
+
+def split_by_sources(page_addresses, max_sources):
+    # consecutive runs of pages, each from at most max_sources different files
+    parts = []
+    cur = []
+    cur_sources = set()
+    for file_name, page_num in page_addresses:
+        if file_name not in cur_sources and len(cur_sources) >= max_sources:
+            parts.append(cur)
+            cur = []
+            cur_sources = set()
+        cur.append((file_name, page_num))
+        cur_sources.add(file_name)
+    if len(cur) > 0:
+        parts.append(cur)
+    return parts
+
+
+def write_pages(sources, page_addresses, out_path, level=0):
+    # page_addresses are (file name, page number) pairs in the source folder
+    if sources.max_open is None or len(source_files(page_addresses)) <= sources.max_open:
+        writer = PyPDF2.PdfFileWriter()
+        sources.pin(source_files(page_addresses))
+        try:
+            for file_name, page_num in page_addresses:
+                writer.addPage(sources.page(file_name, page_num))
+            with open(out_path, 'wb') as out_file:
+                writer.write(out_file)
+        finally:
+            sources.unpin()
+        return
+
+    # The file needs more sources than may be open at once. It is written in parts with few enough sources,
+    # and the parts are joined afterwards (again in parts, if there are too many of them).
+    parts = split_by_sources(page_addresses, sources.max_open)
+    logger.debug('Writing %s in %d parts.', out_path, len(parts))
+    folder, name = os.path.split(out_path)
+    part_addresses = []
+    part_names = []
+    try:
+        for i, part in enumerate(parts):
+            part_name = '.{}.part{}_{:04d}'.format(name, level, i)
+            part_names.append(part_name)
+            write_pages(sources, part, os.path.join(folder, part_name))
+            part_addresses.extend((part_name, page_num) for page_num in range(len(part)))
+        # the parts are the sources now
+        sources.close()
+        with SourcePdfs(folder, sources.max_open) as part_sources:
+            write_pages(part_sources, part_addresses, out_path, level + 1)
+    finally:
+        for part_name in part_names:
+            if os.path.isfile(os.path.join(folder, part_name)):
+                os.remove(os.path.join(folder, part_name))
+
+
+# the sources of each (worker) process, they stay open for all output files the process writes
+_sources = dict()
+
+
+def get_sources(folder, max_open=None):
+    if folder not in _sources:
+        _sources[folder] = SourcePdfs(folder, max_open)
+    return _sources[folder]
+
+
+def close_sources():
+    for sources in _sources.values():
+        sources.close()
+    _sources.clear()
+
+
+def write_output(task):
+    # Runs in the worker processes. task is (source folder, max open sources, page addresses, output path,
+    # sources that no other output file needs afterwards)
+    folder, max_open, page_addresses, out_path, last_uses = task
+    sources = get_sources(folder, max_open)
+    write_pages(sources, page_addresses, out_path)
+    for file_name in last_uses:
+        sources.release(file_name)
+    return out_path
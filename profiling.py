@@ -0,0 +1,112 @@
+import csv
+import json
+import time
+import logging
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger('medocr.profile')
+
+# the stages of the recognition, in the order in which a page passes them
+STAGES = ['rasterize', 'fingerprint', 'decode', 'marker detect', 'square check', 'field extract', 'ocr', 'preview',
+          'index write']
+PERCENTILES = [50, 90, 99]
+
+
+@contextmanager
+def timed(timings, stage):
+    # adds the duration of the block to timings[stage], does nothing if timings is None
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.) + time.perf_counter() - start
+
+
+class Profiler:
+    # Collects the durations of the stages, for each page. The worker processes measure their stages themselves
+    # and send the durations back with the results of the pages.
+    def __init__(self):
+        # (file name, page number, stage, seconds), the file name and page number are None for stages
+        # that do not belong to a single page
+        self.records = []
+
+    def add(self, timings, file_name=None, page_num=None):
+        for stage, seconds in timings.items():
+            self.records.append((file_name, page_num, stage, seconds))
+        if file_name is not None:
+            logger.debug('%s, page %d: %s', file_name, page_num + 1,
+                         ', '.join('{} {:.1f} ms'.format(stage, 1000 * seconds) for stage, seconds in timings.items()))
+
+    def summary(self):
+        durations = dict()
+        for file_name, page_num, stage, seconds in self.records:
+            durations.setdefault(stage, []).append(seconds)
+        stages = [s for s in STAGES if s in durations] + sorted(s for s in durations if s not in STAGES)
+        lines = []
+        for stage in stages:
+            d = 1000 * np.array(durations[stage])
+            lines.append('{:>14}: {:6d} x, total {:8.2f} s, mean {:8.2f} ms, {}, max {:8.2f} ms'
+                         ''.format(stage, len(d), np.sum(d) / 1000, np.mean(d),
+                                   ', '.join('p{} {:8.2f} ms'.format(p, np.percentile(d, p)) for p in PERCENTILES),
+                                   np.max(d)))
+        return lines
+
+    def write_trace(self, path):
+        # json, if the file name ends with .json, otherwise csv
+        fields = ['file', 'page', 'stage', 'seconds']
+        # page numbers start with 1, like in the messages
+        rows = [[f, p + 1 if p is not None else None, stage, seconds] for f, p, stage, seconds in self.records]
+        if path.endswith('.json'):
+            with open(path, 'w') as file:
+                json.dump([dict(zip(fields, row)) for row in rows], file, indent=1)
+        else:
+            with open(path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(fields)
+                writer.writerows(rows)
+
+
+_profiler = None
+
+
+def enable():
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def record(timings, file_name=None, page_num=None):
+    if _profiler is not None and timings is not None:
+        _profiler.add(timings, file_name, page_num)
+
+
+def report(trace_path=None):
+    # prints the summary and writes the trace, if the profiling is enabled
+    if _profiler is None:
+        return
+    for line in _profiler.summary():
+        logger.info(line)
+    if trace_path is not None:
+        _profiler.write_trace(trace_path)
+        logger.info('Wrote the profile trace to %s', trace_path)
+
+
+@contextmanager
+def profile(stage):
+    # times a stage that does not belong to a single page, in the main process
+    if _profiler is None:
+        yield
+        return
+    timings = dict()
+    with timed(timings, stage):
+        yield
+    _profiler.add(timings)
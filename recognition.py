@@ -0,0 +1,282 @@
+import copy
+import time
+import logging
+import cv2
+
+from find_markers import find_markers, warp_strip, cut_ocr_fields, marker_strip_box, MarkerException
+from pageid import page_id_from_ocr
+from parallel_utils import Prefetcher
+from ocr import get_ocr_backend, read_fields
+from digits import get_digit_classifier
+from fingerprints import fingerprint
+from page_store import encode_preview, encode_strip
+from profiling import timed
+from rendering import render_page_region
+
+logger = logging.getLogger('medocr.'+__name__)
+
+
+class PageResult:
+    def __init__(self, exam_id=None, page_id=None, error=None):
+        self.exam_id = exam_id
+        self.page_id = page_id
+        self.error = error
+        self.fingerprint = None
+        # seconds per stage, when the recognition is profiled
+        self.timings = None
+        # encoded images for the page store
+        self.preview = None
+        self.strip = None
+        # the bounding box of the markers and the fields in the recognized image, if the markers were found
+        self.strip_box = None
+
+
+def init_worker():
+    # every worker process already occupies one core, OpenCV should not start threads on top of that
+    cv2.setNumThreads(1)
+
+
+def load_image(image):
+    # pages are either the paths of rendered image files or grayscale arrays that were rendered in memory
+    if isinstance(image, str):
+        return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    return image
+
+
+class PageRecognizer:
+    # The settings of the page recognition. Instances are sent to the worker processes,
+    # so they only hold plain settings; the OCR backend is looked up in each process.
+    def __init__(self, ocr_backend='auto', ocr_batch_pages=0, digit_classifier=True, digit_templates=None,
+                 preview_scale=None, profile=False):
+        self.ocr_backend = ocr_backend
+        # 0 reads each field with its own OCR call, otherwise the fields of this many pages
+        # are tiled into one image and read with a single OCR call
+        self.ocr_batch_pages = ocr_batch_pages
+        # the built in classifier reads the printed digits, tesseract only gets the fields it cannot read
+        self.digit_classifier = digit_classifier
+        self.digit_templates = digit_templates
+        # the size of the previews for the page store relative to the rendered pages, None makes no previews
+        self.preview_scale = preview_scale
+        # False makes no previews of the pages, only of the strips, e.g. when only a band of the pages is rendered
+        self.page_previews = True
+        # measure the durations of the stages of each page
+        self.profile = profile
+
+    def without_page_previews(self):
+        recognizer = copy.copy(self)
+        recognizer.page_previews = False
+        return recognizer
+
+    def makes_page_previews(self):
+        return self.preview_scale is not None and self.page_previews
+
+    def make_preview(self, image):
+        if not self.makes_page_previews():
+            return None
+        return encode_preview(image, self.preview_scale)
+
+    def pages_per_task(self):
+        return max(1, self.ocr_batch_pages)
+
+    def recognize(self, image):
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images):
+        # This runs in the worker processes and must not depend on the state of the collection.
+        # The exam id is checked by the caller, in page order.
+        results = [None] * len(images)
+        previews = [None] * len(images)
+        strips = [None] * len(images)
+        timings = [dict() if self.profile else None for image in images]
+        located = []
+        fields = []
+        for i, image in enumerate(images):
+            with timed(timings[i], 'decode'):
+                cv_image = load_image(image)
+            with timed(timings[i], 'preview'):
+                previews[i] = self.make_preview(cv_image)
+            try:
+                left_marker, right_marker, left_id = find_markers(cv_image, timings=timings[i])
+                with timed(timings[i], 'field extract'):
+                    strip, ref_length = warp_strip(cv_image, left_marker, right_marker)
+                    ocr_fields = cut_ocr_fields(strip, ref_length)
+            except MarkerException as mex:
+                results[i] = PageResult(error=mex)
+            else:
+                located.append((i, left_id, marker_strip_box(left_marker, right_marker)))
+                fields.extend(ocr_fields)
+                if self.preview_scale is not None:
+                    with timed(timings[i], 'preview'):
+                        strips[i] = encode_strip(strip)
+
+        backend = get_ocr_backend(self.ocr_backend)
+        classifier = get_digit_classifier(self.digit_templates) if self.digit_classifier else None
+        start_time = time.perf_counter()
+        ocr_strings = read_fields(backend, fields, batched=self.ocr_batch_pages > 0, classifier=classifier)
+        ocr_seconds = time.perf_counter() - start_time
+        for k, (i, left_id, strip_box) in enumerate(located):
+            results[i] = PageResult(left_id, page_id_from_ocr(left_id, ocr_strings[3 * k:3 * k + 3]))
+            results[i].strip_box = strip_box
+            if self.profile:
+                # the fields of all pages may have been read together, each page gets its share
+                timings[i]['ocr'] = ocr_seconds / len(located)
+        for result, preview, strip, page_timings in zip(results, previews, strips, timings):
+            result.preview = preview
+            result.strip = strip
+            result.timings = page_timings
+        return results
+
+
+def split_into_tasks(images, pages_per_task):
+    return [images[i:i + pages_per_task] for i in range(0, len(images), pages_per_task)]
+
+
+def imap_pages(pool, recognizer, images):
+    # the pool starts on the tasks right away, only the results are collected lazily
+    tasks = split_into_tasks(images, recognizer.pages_per_task())
+    batches = pool.imap(recognizer.recognize_batch, tasks)
+    return (result for results in batches for result in results)
+
+
+def imap_window(pool, recognizer, images, known_pages, render_seconds=None):
+    # Pages whose fingerprint is known reuse the known page id, only the others are sent to the pool.
+    # The results are merged back in page order.
+    start_time = time.perf_counter()
+    keys = [fingerprint(image) for image in images] if known_pages is not None else [None] * len(images)
+    fingerprint_seconds = time.perf_counter() - start_time
+    known = [known_pages.get(key) if key is not None else None for key in keys]
+    unknown_images = [image for image, page_id in zip(images, known) if page_id is None]
+    if len(unknown_images) < len(images):
+        logger.debug('Reusing %d known pages.', len(images) - len(unknown_images))
+    results = imap_pages(pool, recognizer, unknown_images)
+
+    def merge():
+        for image, key, page_id in zip(images, keys, known):
+            if page_id is None:
+                result = next(results)
+            else:
+                result = PageResult(page_id.exam, page_id)
+                if recognizer.makes_page_previews():
+                    result.preview = recognizer.make_preview(load_image(image))
+            result.fingerprint = key
+            if recognizer.profile:
+                if result.timings is None:
+                    result.timings = dict()
+                # the pages of a window are rendered together
+                if render_seconds is not None:
+                    result.timings['rasterize'] = render_seconds / len(images)
+                if known_pages is not None:
+                    result.timings['fingerprint'] = fingerprint_seconds / len(images)
+            yield result
+    return merge()
+
+
+def needs_retry(result):
+    return result.error is not None or result.page_id is None or not result.page_id.is_valid()
+
+
+def retry_resolution(renderer, window, result):
+    # the resolution at which a page is rendered again, None if it is not retried
+    if not needs_retry(result):
+        return None
+    if renderer.retry_dpi is None and window.box is not None and result.error is not None:
+        # the markers are not in the band, the whole page is rendered
+        return renderer.dpi
+    return renderer.retry_dpi
+
+
+def render_retry(pdf, page_num, result, renderer, dpi):
+    # If the markers were found, only the strip with the markers and the fields is rendered, otherwise the whole
+    # page. Returns the image, the rendered box and the seconds it took.
+    scale = dpi / renderer.dpi
+    box = None
+    if result.strip_box is not None:
+        box = [int(round(scale * v)) for v in result.strip_box]
+    start_time = time.perf_counter()
+    image = render_page_region(pdf, page_num, dpi, box)
+    return image, box, time.perf_counter() - start_time
+
+
+def merge_retry(page_num, result, retried, image, box, render_seconds, renderer, recognizer, dpi):
+    if needs_retry(retried):
+        logger.debug('Page %d was not recognized at %d dpi either.', page_num + 1, dpi)
+        return result
+    logger.debug('Recognized page %d at %d dpi.', page_num + 1, dpi)
+    scale = dpi / renderer.dpi
+    # the fingerprint belongs to the page as it was rendered first, and so does the preview,
+    # unless the whole page was rendered now
+    retried.fingerprint = result.fingerprint
+    if box is None and recognizer.makes_page_previews():
+        retried.preview = encode_preview(image, recognizer.preview_scale / scale)
+        retried.strip_box = tuple(int(round(v / scale)) for v in retried.strip_box)
+    else:
+        retried.preview = result.preview
+        retried.strip_box = result.strip_box
+    if retried.strip is None:
+        retried.strip = result.strip
+    if recognizer.profile:
+        timings = dict(result.timings) if result.timings is not None else dict()
+        for stage, seconds in retried.timings.items():
+            timings[stage] = timings.get(stage, 0.) + seconds
+        timings['rasterize'] = timings.get('rasterize', 0.) + render_seconds
+        retried.timings = timings
+    return retried
+
+
+def retry_failed(pdf, window, results, renderer, recognizer, pool):
+    # The pages of the window that were not recognized are rendered again and sent to the pool together.
+    # They are recognized by the pool, the calling thread may not be the only one using an OCR backend.
+    # This runs while the results of the window are collected, when the next window is already queued,
+    # so the pool should be a separate one that is not busy with the next window.
+    results = list(results)
+    retries = []
+    for i, result in enumerate(results):
+        if window.box is not None and result.strip_box is not None:
+            # only the band of the page was rendered, the strip box is moved to the coordinates of the page
+            x, y, width, height = result.strip_box
+            result.strip_box = (x + window.box[0], y + window.box[1], width, height)
+        dpi = retry_resolution(renderer, window, result)
+        if dpi is not None:
+            image, box, render_seconds = render_retry(pdf, window.first_page + i, result, renderer, dpi)
+            retries.append((i, dpi, image, box, render_seconds))
+    if len(retries) > 0:
+        # the previews of the pages that are rendered completely are made below, at the right scale
+        retried_results = imap_pages(pool, recognizer.without_page_previews(),
+                                     [image for i, dpi, image, box, seconds in retries])
+        for (i, dpi, image, box, render_seconds), retried in zip(retries, retried_results):
+            results[i] = merge_retry(window.first_page + i, results[i], retried, image, box, render_seconds,
+                                     renderer, recognizer, dpi)
+    yield from results
+
+
+def recognize_pdf(pdf, work_folder, renderer, recognizer, pool, known_pages=None, retry_pool=None):
+    # Yields the results in page order. While the results of one window are collected, the workers
+    # already read the next window, and the window after that is rendered in the background.
+    # known_pages maps page fingerprints to page ids that do not need to be recognized again.
+    # Pages that are not recognized are rendered again at renderer.retry_dpi, if it is set. If only the band
+    # with the markers was rendered, the pages without markers in the band are rendered completely.
+    # The retries of a window are only known once its results arrive, when the next window is already queued
+    # in pool. They go to retry_pool, so that they do not wait for the next window. Without a retry_pool,
+    # they are queued in pool behind the next window.
+    if retry_pool is None:
+        retry_pool = pool
+    pending = []
+    try:
+        for window in Prefetcher(renderer.windows(pdf, work_folder), depth=1):
+            # the band of a page makes no preview of the page
+            window_recognizer = recognizer if window.box is None else recognizer.without_page_previews()
+            results = imap_window(pool, window_recognizer, window.images, known_pages, window.render_seconds)
+            pending.append((window, retry_failed(pdf, window, results, renderer, recognizer, retry_pool)))
+            if len(pending) > 1:
+                window, results = pending[0]
+                yield from results
+                pending.pop(0)
+                window.release()
+        while len(pending) > 0:
+            window, results = pending[0]
+            yield from results
+            pending.pop(0)
+            window.release()
+    finally:
+        for window, results in pending:
+            window.release()
@@ -0,0 +1,187 @@
+import os
+import shutil
+import logging
+import time
+import subprocess
+from pdf2image import convert_from_path
+import PyPDF2
+import numpy as np
+import os_utils
+from find_markers import find_markers, marker_strip_box, MarkerException
+
+logger = logging.getLogger('medocr.'+__name__)
+
+
+def count_pages(pdf):
+    with open(pdf, 'rb') as file:
+        return PyPDF2.PdfFileReader(file).getNumPages()
+
+
+def read_pgm_images(data):
+    # pdftoppm -gray writes the pages as binary pgm images, one after the other
+    images = []
+    pos = 0
+    while pos < len(data):
+        # magic number, width, height and maximum value, separated by whitespace
+        header = []
+        while len(header) < 4:
+            while pos < len(data) and data[pos:pos + 1].isspace():
+                pos += 1
+            end = pos
+            while end < len(data) and not data[end:end + 1].isspace():
+                end += 1
+            if end == pos:
+                raise ValueError('The pgm stream ends in the header of image {}.'.format(len(images) + 1))
+            header.append(data[pos:end])
+            pos = end
+        if header[0] != b'P5' or not header[1].isdigit() or not header[2].isdigit() or header[3] != b'255':
+            raise ValueError('Image {} is not an 8 bit binary pgm image, its header is {}.'
+                             ''.format(len(images) + 1, b' '.join(header)))
+        # a single whitespace character separates the header from the pixels
+        pos += 1
+        width, height = int(header[1]), int(header[2])
+        if pos + width * height > len(data):
+            raise ValueError('The pgm stream ends in the pixels of image {}.'.format(len(images) + 1))
+        images.append(np.frombuffer(data, dtype=np.uint8, count=width * height, offset=pos).reshape(height, width))
+        pos += width * height
+    return images
+
+
+def render_pages_region(pdf, first_page, last_page, dpi, box=None):
+    # Renders the pages first_page to last_page - 1 with poppler, first_page is zero based.
+    # box is (x, y, width, height) in pixels at the given dpi, only this part of the pages is rendered.
+    # Without a box, the whole pages are rendered.
+    command = ['pdftoppm', '-r', str(dpi), '-f', str(first_page + 1), '-l', str(last_page), '-gray']
+    if box is not None:
+        x, y, width, height = box
+        command += ['-x', str(x), '-y', str(y), '-W', str(width), '-H', str(height)]
+    # without an output file, pdftoppm writes the images to stdout
+    output = subprocess.run(command + [pdf], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+    images = read_pgm_images(output)
+    if len(images) != last_page - first_page:
+        raise ValueError('Poppler rendered {} images for the pages {} to {} of {}.'
+                         ''.format(len(images), first_page + 1, last_page, pdf))
+    return images
+
+
+def render_page_region(pdf, page_num, dpi, box=None):
+    return render_pages_region(pdf, page_num, page_num + 1, dpi, box)[0]
+
+
+def find_band(pdf, num_pages, dpi, max_pages=5):
+    # The band of the pages that contains the markers and the fields, learned from the first page on which
+    # the markers are found. The band is larger than the strip, so that it still contains the strip
+    # if the pages are scanned with a slight offset or rotation. Returns None, if no markers are found.
+    for page_num in range(min(num_pages, max_pages)):
+        image = render_page_region(pdf, page_num, dpi)
+        try:
+            left_marker, right_marker, left_id = find_markers(image)
+        except MarkerException:
+            continue
+        x, y, width, height = marker_strip_box(left_marker, right_marker)
+        # the strip box has a margin of one marker length, the band one more marker length on each side
+        margin = height // 3
+        x0, y0 = max(x - margin, 0), max(y - margin, 0)
+        x1, y1 = min(x + width + margin, image.shape[1]), min(y + height + margin, image.shape[0])
+        logger.debug('Found the band of the markers on page %d of %s.', page_num + 1, pdf)
+        return x0, y0, x1 - x0, y1 - y0
+    return None
+
+
+def band_from_millimeters(band, dpi):
+    return tuple(int(round(v / 25.4 * dpi)) for v in band)
+
+
+class PageWindow:
+    def __init__(self, first_page, images, folder=None, render_seconds=None, box=None):
+        # first_page is zero based, like the page numbers in the index
+        self.first_page = first_page
+        self.images = images
+        self._folder = folder
+        self.render_seconds = render_seconds
+        # the part of the pages that was rendered, (x, y, width, height) in pixels, None for the whole pages
+        self.box = box
+
+    def release(self):
+        self.images = []
+        if self._folder is not None and os.path.isdir(self._folder):
+            shutil.rmtree(self._folder)
+
+
+class PageRenderer:
+    # Renders a pdf in windows of consecutive pages, so that memory and disk usage
+    # are bounded by the window size and not by the length of the pdf.
+    window_prefix = 'pages_'
+
+    def __init__(self, dpi=200, window_size=20, in_memory=False, retry_dpi=None, band=None):
+        if window_size < 1:
+            raise ValueError('The window size must be at least 1, got {}'.format(window_size))
+        self.dpi = dpi
+        # pages that are not recognized at dpi are rendered again at retry_dpi, None does not retry them
+        self.retry_dpi = retry_dpi
+        # Only the band of the pages with the markers is rendered: 'auto' finds it on the first pages of each pdf,
+        # otherwise it is (x, y, width, height) in millimeters. Pages without markers in the band are
+        # rendered completely later on. None renders the whole pages.
+        self.band = band
+        self.window_size = window_size
+        # in memory, the pages are read from the pgm output of poppler into numpy arrays,
+        # otherwise they are written to jpg files in the work folder
+        self.in_memory = in_memory
+
+    def windows(self, pdf, work_folder):
+        # each pdf gets its own folder, several pdfs may be rendered at the same time
+        work_folder = os.path.join(work_folder, os.path.basename(pdf))
+        os_utils.make_directories_if_nonexistent(work_folder)
+        self.clear_windows(work_folder)
+        num_pages = count_pages(pdf)
+        box = self.band_box(pdf, num_pages)
+        logger.info('Converting the file "%s" to images.', pdf)
+        start_time = time.time()
+        for first_page in range(0, num_pages, self.window_size):
+            last_page = min(first_page + self.window_size, num_pages)
+            render_start = time.perf_counter()
+            if box is not None:
+                # the bands are small, they are always kept in memory
+                folder = None
+                images = render_pages_region(pdf, first_page, last_page, self.dpi, box)
+            elif self.in_memory:
+                folder = None
+                images = self.render_to_arrays(pdf, first_page, last_page)
+            else:
+                folder = os.path.join(work_folder, '{}{:05d}'.format(PageRenderer.window_prefix, first_page + 1))
+                os_utils.mkdir_if_nonexistent(folder)
+                images = convert_from_path(pdf, dpi=self.dpi, first_page=first_page + 1, last_page=last_page,
+                                           fmt='jpg', grayscale=True, output_folder=folder, paths_only=True)
+            logger.debug('Converted pages %d to %d.', first_page + 1, last_page)
+            if first_page == 0 and last_page < num_pages:
+                time_elapsed = time.time() - start_time
+                logger.info('Estimated time for conversion is {:.0f} seconds.'
+                            ''.format(num_pages * time_elapsed / last_page))
+            yield PageWindow(first_page, images, folder, time.perf_counter() - render_start, box)
+        logger.debug('Completed conversion.')
+
+    def retries_pages(self):
+        # pages that are not recognized are rendered again at retry_dpi, or completely if only the band was rendered
+        return self.retry_dpi is not None or self.band is not None
+
+    def band_box(self, pdf, num_pages):
+        # the band in pixels, or None if the whole pages are rendered
+        if self.band is None:
+            return None
+        if self.band != 'auto':
+            return band_from_millimeters(self.band, self.dpi)
+        box = find_band(pdf, num_pages, self.dpi)
+        if box is None:
+            logger.info('No markers found on the first pages of "%s", converting the whole pages.', pdf)
+        return box
+
+    def render_to_arrays(self, pdf, first_page, last_page):
+        return render_pages_region(pdf, first_page, last_page, self.dpi)
+
+    @staticmethod
+    def clear_windows(work_folder):
+        # left overs from an interrupted run
+        for item in os.listdir(work_folder):
+            path = os.path.join(work_folder, item)
+            if item.startswith(PageRenderer.window_prefix) and os.path.isdir(path):
+                shutil.rmtree(path)
@@ -0,0 +1,76 @@
+import os
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from rendering import render_page_region
+
+logger = logging.getLogger('medocr.'+__name__)
+
+
+def render_page(pdf, page_num, dpi=100):
+    # page_num is zero based, like the page numbers in the index
+    return render_page_region(pdf, page_num, dpi)
+
+
+class ThumbnailCache:
+    # Renders the pages that are shown for the manual relabeling in background threads, in the order in which
+    # they are going to be shown. While one page is shown, the next pages are already rendered.
+    # At most max_pages pages are kept, the pages that are coming up next are never dropped.
+    # Pages with a preview in the page store are not rendered again.
+    def __init__(self, folder, dpi=100, ahead=4, max_pages=16, threads=2, page_store=None):
+        self._folder = folder
+        self._page_store = page_store
+        self.dpi = dpi
+        self.ahead = ahead
+        self.max_pages = max(max_pages, ahead + 1)
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        # (file name, page number) -> future of the image, in the order of the last use
+        self._pages = OrderedDict()
+        self._upcoming = []
+        self._position = dict()
+
+    def set_order(self, addresses):
+        # addresses are (file name, page number) pairs, in the order in which the pages will be shown
+        self._upcoming = list(addresses)
+        self._position = dict()
+        for i, address in enumerate(self._upcoming):
+            self._position.setdefault(address, i)
+        self._prefetch(0)
+
+    def _prefetch(self, start):
+        upcoming = self._upcoming[start:start + self.ahead]
+        for address in upcoming:
+            self._submit(address)
+        for address in list(self._pages.keys()):
+            if len(self._pages) <= self.max_pages:
+                break
+            if address not in upcoming:
+                self._pages.pop(address).cancel()
+
+    def _submit(self, address):
+        if address not in self._pages:
+            self._pages[address] = self._executor.submit(self.render, address)
+        return self._pages[address]
+
+    def render(self, address):
+        file_name, page_num = address
+        if self._page_store is not None:
+            image = self._page_store.preview(file_name, page_num)
+            if image is not None:
+                return image
+        return render_page(os.path.join(self._folder, file_name), page_num, self.dpi)
+
+    def get(self, file_name, page_num):
+        address = (file_name, page_num)
+        future = self._submit(address)
+        self._pages.move_to_end(address)
+        if address in self._position:
+            self._prefetch(self._position[address] + 1)
+        return future.result()
+
+    def close(self):
+        for future in self._pages.values():
+            future.cancel()
+        self._pages = OrderedDict()
+        self._executor.shutdown(wait=False)
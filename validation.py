@@ -0,0 +1,109 @@
+import logging
+import numpy as np
+
+from pageid import ID_FIELDS, to_column_value, from_column_value
+
+logger = logging.getLogger('medocr.'+__name__)
+
+KEY_DTYPE = np.dtype([(field, '<i4') for field in ID_FIELDS])
+
+
+def key_of(page_id):
+    return tuple(to_column_value(v) for v in page_id.tuple())
+
+
+def key_to_tuple(key):
+    return tuple(from_column_value(v) for v in key)
+
+
+def group_rows(table):
+    # Sorts the rows by their page id, rows with the same id stay in index order. Returns the sorted unique keys,
+    # and the rows of each key: order[starts[i]:starts[i+1]]
+    columns = [table.column(field) for field in ID_FIELDS]
+    order = np.lexsort(columns[::-1])
+    sorted_columns = [column[order] for column in columns]
+    same_as_previous = np.ones(max(len(order) - 1, 0), dtype=bool)
+    for column in sorted_columns:
+        same_as_previous &= column[1:] == column[:-1]
+    first = np.flatnonzero(np.append(len(order) > 0, ~same_as_previous))
+    unique = np.empty(len(first), dtype=KEY_DTYPE)
+    for field, column in zip(ID_FIELDS, sorted_columns):
+        unique[field] = column[first]
+    return unique, order, np.append(first, len(order))
+
+
+def order_duplicates(rows):
+    # the order in which a scan through the index finds them: the second occurrence, the first one and the rest
+    rows = sorted(rows)
+    return [rows[1], rows[0]] + rows[2:]
+
+
+class DuplicateFinder:
+    # Groups all pages of the collection by their page id once. Afterwards, only the page ids of the relabeled pages
+    # need to be checked again: every other duplicate was found before, and all of its pages were relabeled.
+    def __init__(self, file_names, file_nums, file_pages, table):
+        self._file_names = file_names
+        self._file_nums = file_nums
+        self._file_pages = file_pages
+        # the rows are ordered by file
+        first_rows = np.searchsorted(file_nums, np.arange(len(file_names))).tolist()
+        self._first_row = {file_name: row for file_name, row in zip(file_names, first_rows)}
+        self._unique, self._order, self._starts = group_rows(table)
+        # relabeled rows -> their new key, and the other way round
+        self._relabeled = dict()
+        self._relabeled_by_key = dict()
+        # the keys assigned since the last check
+        self._candidates = []
+        self._checked_all = False
+
+    def address(self, row):
+        return self._file_names[self._file_nums[row]], int(self._file_pages[row])
+
+    def relabel(self, file_name, page_num, page_id):
+        row = self._first_row[file_name] + page_num
+        key = key_of(page_id)
+        if row in self._relabeled:
+            self._relabeled_by_key[self._relabeled[row]].discard(row)
+        self._relabeled[row] = key
+        self._relabeled_by_key.setdefault(key, set()).add(row)
+        self._candidates.append(key)
+
+    def rows_with_key(self, key):
+        i = np.searchsorted(self._unique, np.array([key], dtype=KEY_DTYPE))[0]
+        rows = []
+        if i < len(self._unique) and self._unique[i].tolist() == key:
+            rows = [r for r in self._order[self._starts[i]:self._starts[i + 1]].tolist() if r not in self._relabeled]
+        return rows + list(self._relabeled_by_key.get(key, ()))
+
+    def duplicates(self):
+        # Returns a dict from the duplicate page ids to the addresses (file name, page number) of their pages.
+        # The first call looks at all pages, later calls only at the page ids assigned since the previous call.
+        keys = []
+        if not self._checked_all:
+            keys = [self._unique[i].tolist() for i in np.flatnonzero(np.diff(self._starts) > 1)]
+            self._checked_all = True
+        keys = list(dict.fromkeys(keys + self._candidates))
+        self._candidates = []
+        groups = []
+        for key in keys:
+            rows = self.rows_with_key(key)
+            if len(rows) > 1:
+                groups.append((order_duplicates(rows), key))
+        # in the order in which a scan through the index finds them
+        groups.sort(key=lambda g: g[0][0])
+        return {key_to_tuple(key): [self.address(row) for row in rows] for rows, key in groups}
+
+
+def find_missing_pages(table, extra_pages=()):
+    # All combinations of a sheet and a page number that occur somewhere in the index, but not together.
+    # Pages that are missing in every sheet are not found this way.
+    sheets = table.column('sheet')
+    pages = table.column('page')
+    all_sheets = np.unique(sheets)
+    counted = ~np.isin(pages, list(extra_pages))
+    all_pages = np.unique(pages[counted])
+    present = np.zeros((len(all_sheets), len(all_pages)), dtype=bool)
+    present[np.searchsorted(all_sheets, sheets[counted]), np.searchsorted(all_pages, pages[counted])] = True
+    missing_sheets, missing_pages = np.nonzero(~present)
+    return [(from_column_value(all_sheets[s]), from_column_value(all_pages[p]))
+            for s, p in zip(missing_sheets.tolist(), missing_pages.tolist())]